@@ -6,18 +6,29 @@
 # Version     : 1.0
 
 import argparse
+import json
 import os
 import random
-
-import cv2
+import time
 
 from PIL import Image
-from FingerprintImage import FingerprintImage
-from ScarGenerator import ScarGenerator
-from ImageDistortion import *
-from HairGenerator import HairGenerator, HairLength
-from WrinkleGenerator import WrinkleGenerator
-from LineGenerator import LineGenerator, LineOrientation, LineLength, LineThickness
+
+import Metrics
+import Profiler
+from BatchRunner import BatchRunner, BACKENDS
+from CostModel import CostModel
+from GenerationServer import GenerationServer, DEFAULT_MAX_REQUESTS
+from ProgressReporter import DEFAULT_INTERVAL
+from HairGenerator import HairLength
+from LineGenerator import LineOrientation, LineLength, LineThickness
+
+# parameters of recipe steps whose values are checked against choices of command line argument of the same name
+RECIPE_STEP_CHOICES = ["level", "type", "length", "width", "orientation"]
+
+# arguments which can not be used in job manifest
+NON_JOB_ARGUMENTS = ["help", "jobs", "workers", "backend", "shared_corpus", "profile", "trace", "metrics",
+                     "metrics_prometheus", "progress_interval", "progress_json", "plan", "cost_model", "serve",
+                     "max_requests"]
 
 
 class ArgParser:
@@ -33,6 +44,9 @@ class ArgParser:
         self.directory = None
         self.name = None
         self.amount = None
+        self.variants = None
+        self.runner = None
+        self.cost_model = None
 
     def add_args(self):
         """
@@ -52,6 +66,7 @@ class ArgParser:
 
         self.parser.add_argument("--hair", action="store_true")
         self.parser.add_argument("--type", choices=["short", "long"], action="store", type=str, dest="type")
+        self.parser.add_argument("--hair-count", action="store", type=str, dest="hair_count")
 
         self.parser.add_argument("--scar", action="store_true")
         self.parser.add_argument("--length", choices=["short", "medium", "long"], action="store", type=str,
@@ -63,6 +78,29 @@ class ArgParser:
         self.parser.add_argument("--patches", action="store_true")
         self.parser.add_argument("--distortion", action="store_true")
         self.parser.add_argument("--random", action="store_true")
+        self.parser.add_argument("--recipe", action="store", type=str, dest="recipe")
+
+        self.parser.add_argument("--max-attempts", action="store", type=int, dest="max_attempts")
+        self.parser.add_argument("--time-budget", action="store", type=float, dest="time_budget")
+
+        self.parser.add_argument("--seed", action="store", type=int, dest="seed")
+        self.parser.add_argument("--jobs", action="store", type=str, dest="jobs")
+        self.parser.add_argument("--workers", action="store", type=int, dest="workers")
+        self.parser.add_argument("--backend", choices=BACKENDS, action="store", type=str, dest="backend")
+        self.parser.add_argument("--shared-corpus", action="store_true", dest="shared_corpus")
+        self.parser.add_argument("--variants-per-image", action="store", type=int, dest="variants_per_image")
+        self.parser.add_argument("--library", action="store", type=str, dest="library")
+        self.parser.add_argument("--build-library", action="store", type=str, dest="build_library")
+        self.parser.add_argument("--profile", action="store", type=str, dest="profile")
+        self.parser.add_argument("--trace", action="store", type=str, dest="trace")
+        self.parser.add_argument("--metrics", action="store", type=str, dest="metrics")
+        self.parser.add_argument("--metrics-prometheus", action="store", type=str, dest="metrics_prometheus")
+        self.parser.add_argument("--progress-interval", action="store", type=float, dest="progress_interval")
+        self.parser.add_argument("--progress-json", action="store", type=str, dest="progress_json")
+        self.parser.add_argument("--plan", action="store_true")
+        self.parser.add_argument("--cost-model", action="append", type=str, dest="cost_model")
+        self.parser.add_argument("--serve", action="store", type=str, dest="serve")
+        self.parser.add_argument("--max-requests", action="store", type=int, dest="max_requests")
 
         self.args = self.parser.parse_args()
 
@@ -142,6 +180,35 @@ class ArgParser:
         else:
             self.amount = 1
 
+    def configure_variants(self):
+        """
+
+        @brief: Sets number of images generated from one fingerprint template. If not specified, default value is 1
+        :return: None
+        """
+        if self.args.variants_per_image is None:
+            self.variants = 1
+        elif self.args.variants_per_image > 0:
+            self.variants = self.args.variants_per_image
+        else:
+            print("Number of variants per image must be positive number.")
+            os._exit(-1)
+
+    def configure_library(self):
+        """
+
+        @brief: Checks damage library arguments. Directory of built library is created if it does not exist
+        :return: None
+        """
+        if self.args.library and self.args.build_library:
+            print("Damage library can not be built and applied at the same time.")
+            os._exit(-1)
+        if self.args.library and not self.is_valid_directory(self.args.library):
+            print("Path to damage library is not valid.")
+            os._exit(-1)
+        if self.args.build_library:
+            os.makedirs(self.args.build_library, exist_ok=True)
+
     def configure_basic_arguments(self):
         """
 
@@ -150,6 +217,10 @@ class ArgParser:
                 pictures and folder in which the image will be saved.
         :return: None
         """
+        self.save_folder = None
+        self.image = None
+        self.directory = None
+        self.name = None
         self.configure_save_folder()
         self.configure_image()
         self.configure_directory()
@@ -158,77 +229,108 @@ class ArgParser:
             os._exit(-1)
         self.configure_name()
         self.configure_amount()
+        self.configure_variants()
+        self.configure_library()
 
     def get_damage_type(self):
         """
 
-        @brief: Chooses which type of damage will be generated depending on user input
-        :return: None
+        @brief: Chooses which type of damage will be generated depending on user input and generates it. In case of
+                --plan, images are not generated, only plan of tasks is printed
+        :return: amount of saved images and amount of tasks
         """
-        if self.args.creases:
-            self.generate_creases()
-        if self.args.scar:
-            self.generate_scar()
-        if self.args.hair:
-            self.generate_hair()
+        tasks = self.create_tasks()
+        if self.args.plan:
+            self.plan_tasks(tasks)
+            return 0, len(tasks)
+        results = self.runner.run(tasks, self.get_cost_model(tasks))
+        return sum(result["saved"] for result in results), len(tasks)
 
-    def save_image(self, image, number):
+    def get_cost_model(self, tasks):
         """
 
-        @brief: Saves image in JPG format
-        :param image: Image that will be saved as array
-        :param number: Number of generated images as integer
-        :return: None
+        @brief: Gets cost model calibrated by benchmark results or profiles given by --cost-model, cost model is created
+                only once. Benchmark results measured on size closest to size of the first template are used, template
+                is opened only if cost model is calibrated
+        :param tasks: list of tasks
+        :return: CostModel instance
         """
-        if self.save_folder:
-            save_folder = self.save_folder
-        else:
-            save_folder = r'Generated'
-        if self.name:
-            name = self.name
-        else:
-            name = "damaged_fingerprint"
-        image_name = name + str(number) + '.JPG'
-        print(f"Saving {image_name}")
-        image = cv.cvtColor(image, cv2.COLOR_GRAY2RGB)
+        if self.cost_model is None:
+            self.cost_model = CostModel()
+            image_size = None
+            if tasks and self.args.cost_model:
+                with Image.open(tasks[0]["image"]) as template:
+                    image_size = template.size
+            for path in self.args.cost_model or []:
+                self.cost_model.load(path, image_size)
+        return self.cost_model
 
-        pil_image = Image.fromarray(image)
-        pil_image.save(os.path.join(save_folder, image_name), dpi=(120, 120))
-
-    def generate_creases(self):
+    def plan_tasks(self, tasks):
         """
 
-        @brief: Generates creases into synthetic fingerprint
+        @brief: Prints estimated time of tasks and recommended amount of workers. Only random parameters of damage are
+                sampled
+        :param tasks: list of tasks
         :return: None
         """
-        if self.args.level:
-            level = self.args.level
-        else:
-            level = random.choice((1, 2, 3))
-        for i in range(0, self.amount):
-            fingerprint = self.get_fingerprint_image()
-            wrinkle_generator = WrinkleGenerator(fingerprint)
-            if level == 1:
-                wrinkle_generator.wrinkles_level_1()
-            elif level == 2:
-                wrinkle_generator.wrinkles_level_2()
-            else:
-                wrinkle_generator.wrinkles_level_3()
-            self.save_image(wrinkle_generator.generated_image, i+1)
+        plan = self.get_cost_model(tasks).plan(tasks, len({task["image"] for task in tasks}),
+                                               max(os.cpu_count() or 1, self.args.workers or 1))
+        print(CostModel.format_plan(plan))
 
-    def get_fingerprint_image(self):
+    def create_tasks(self):
         """
 
-        @brief: chooses image in which damage will be generated depending on parameters
-        :return: fingerprint image as array
+        @brief: Creates task for every generated image. Random parameters of damage are chosen here, every task gets
+                its own seed, so generated images are reproducible if --seed is given. In case of directory, template
+                is chosen once for every group of consecutive variants
+        :return: list of tasks (see BatchRunner)
         """
-        if self.image:
+        recipes = self.get_recipes()
+        for steps in recipes:
+            self.validate_recipe(steps)
+            self.validate_library_recipe(steps)
+
+        if self.args.seed is not None:
+            random.seed(self.args.seed)
+
+        tasks = []
+        for steps in recipes:
             image = self.image
-        else:
-            image = self.choose_random_img_from_directory(self.directory)
-        fingerprint = FingerprintImage()
-        fingerprint.load_file_from_path(image)
-        return fingerprint
+            for i in range(0, self.amount):
+                if self.image is None and i % self.variants == 0:
+                    image = random.choice(self.runner.get_corpus(self.directory))
+                tasks.append({
+                    "number": i + 1,
+                    "name": self.name or "damaged_fingerprint",
+                    "save_folder": self.save_folder or "Generated",
+                    "image": image,
+                    "directory": self.directory,
+                    "seed": random.randrange(2 ** 32),
+                    "max_attempts": self.args.max_attempts,
+                    "time_budget": self.args.time_budget,
+                    "steps": steps if self.args.library else [self.resolve_recipe_step(step) for step in steps],
+                    "library": self.args.library,
+                    "build_library": self.args.build_library,
+                    "job": 0,
+                    "output": None,
+                    "damage_mask": False,
+                })
+        return tasks
+
+    def get_recipes(self):
+        """
+
+        @brief: Gets recipes requested by arguments - recipe given by --recipe and one step recipe for every damage
+                given by --creases, --scar and --hair. Recipes are not validated
+        :return: list of recipes, every recipe is list of steps
+        """
+        recipes = []
+        if self.args.recipe:
+            recipes.append(self.load_recipe(self.args.recipe))
+        for damage in ("creases", "scar", "hair"):
+            if getattr(self.args, damage):
+                recipes.append([self.get_step_from_args(damage)])
+        return recipes
 
     @staticmethod
     def parse_scar_length(length):
@@ -275,101 +377,303 @@ class ArgParser:
         elif width == "thin":
             return LineThickness.THIN
 
-    def generate_scar(self):
+    @staticmethod
+    def get_count_range(count):
         """
 
-        @brief: Generates scar into synthetic fingerprint image
-        :return: None
+        @brief: Parses amount given as number or as range in min-max format
+        :param count: amount as string, e.g. 3 or 2-5
+        :return: minimal and maximal amount as integers, raises ValueError if amount is not valid
         """
-        for i in range(0, self.amount):
-            if self.args.length:
-                scar_length = self.args.length
-            else:
-                scar_length = random.choice(("long", "medium", "short"))
-            if self.args.width:
-                scar_width = self.args.width
-            else:
-                scar_width = random.choice(("thin", "medium", "thick"))
-            if self.args.orientation:
-                scar_orientation = self.args.orientation
-            else:
-                scar_orientation = random.choice(("horizontal", "vertical", "diagonal"))
+        try:
+            values = [int(value) for value in count.split("-")]
+        except ValueError:
+            values = []
+        if len(values) == 1:
+            values = values * 2
+        if len(values) != 2 or values[0] < 1 or values[0] > values[1]:
+            raise ValueError("Amount must be positive number or range in format min-max.")
+        return values[0], values[1]
 
-            fingerprint = self.get_fingerprint_image()
-            scar_generator = ScarGenerator(fingerprint)
-            scar_length = self.parse_scar_length(scar_length)
-            scar_width = self.parse_scar_width(scar_width)
-            scar_orientation = self.parse_scar_orientation(scar_orientation)
+    @staticmethod
+    def parse_count_range(count):
+        """
 
-            if self.args.outline:
-                scar_generator.black_outline = True
-            if self.args.patches:
-                scar_generator.artifacts = True
-            if self.args.distortion:
-                scar_generator.distortion = True
+        @brief: Parses amount given as number or as range in min-max format, exits if amount is not valid
+        :param count: amount as string, e.g. 3 or 2-5
+        :return: minimal and maximal amount as integers
+        """
+        try:
+            return ArgParser.get_count_range(count)
+        except ValueError as exc:
+            print(exc)
+            os._exit(-1)
 
-            if self.args.distortion and scar_width != LineThickness.THIN:
-                print("Distortion of papillary lines is only supported in combination with thin scars")
-                return -1
+    def load_recipe(self, recipe):
+        """
 
-            scar_generator.generate_line(scar_length, scar_orientation, scar_width)
-            self.save_image(scar_generator.background, i + 1)
+        @brief: Loads recipe of damage applied in sequence to the same fingerprint. Recipe is either path to JSON file
+                with list of steps, e.g. [{"damage": "creases", "level": 2}, {"damage": "hair", "hair_count": "1-3"}],
+                or comma separated list of damage types (e.g. creases,scar,hair) whose parameters are taken from other
+                arguments (--level, --length, --width, --orientation, --outline, --patches, --distortion, --type,
+                --hair-count). Parameters missing in step are chosen randomly. Recipe can be also given directly as list
+                of steps (e.g. in job manifest)
+        :param recipe: path to JSON file, comma separated damage types as string or list of steps
+        :return: list of steps as dictionaries
+        """
+        if isinstance(recipe, list):
+            steps = recipe
+            if not all(isinstance(step, dict) for step in steps):
+                print("Recipe must be list of steps.")
+                os._exit(-1)
+        elif os.path.isfile(recipe):
+            try:
+                with open(recipe) as recipe_file:
+                    steps = json.load(recipe_file)
+            except (OSError, ValueError) as exc:
+                print(f"Recipe could not be loaded: {exc}")
+                os._exit(-1)
+            if not isinstance(steps, list) or not all(isinstance(step, dict) for step in steps):
+                print("Recipe must be list of steps.")
+                os._exit(-1)
+        else:
+            steps = [self.get_step_from_args(damage) for damage in recipe.split(",")]
+        return steps
+
+    def get_step_from_args(self, damage):
+        """
+
+        @brief: Creates recipe step of given damage type with parameters taken from arguments
+        :param damage: creases, scar or hair as string
+        :return: recipe step as dictionary
+        """
+        if damage == "creases":
+            return {"damage": damage, "level": self.args.level}
+        elif damage == "scar":
+            return {"damage": damage, "length": self.args.length, "width": self.args.width,
+                    "orientation": self.args.orientation, "outline": self.args.outline,
+                    "patches": self.args.patches, "distortion": self.args.distortion}
+        else:
+            return {"damage": damage, "type": self.args.type, "hair_count": self.args.hair_count}
+
+    def get_recipe_error(self, steps):
+        """
 
-    def generate_hair(self):
+        @brief: Checks if all recipe steps are supported and their parameters have the same values as allowed by
+                command line arguments of the same name
+        :param steps: list of recipe steps
+        :return: error message as string, None if recipe is valid
         """
+        actions = {action.dest: action for action in self.parser._actions}
+        for step in steps:
+            if step.get("damage") not in ("creases", "scar", "hair"):
+                return f"Unknown damage in recipe: {step.get('damage')}. Supported damage is creases, scar and hair."
+            for key in RECIPE_STEP_CHOICES:
+                if step.get(key) is not None and step[key] not in actions[key].choices:
+                    return f"Invalid value of {key} in recipe: {step[key]}"
+            if step["damage"] == "hair" and step.get("hair_count"):
+                try:
+                    self.get_count_range(str(step["hair_count"]))
+                except ValueError as exc:
+                    return f"Invalid value of hair_count in recipe: {step['hair_count']}. {exc}"
+            if step["damage"] == "scar" and step.get("distortion") and step.get("width") not in (None, "thin"):
+                return "Distortion of papillary lines is only supported in combination with thin scars"
+        return None
 
-        @brief: Generates hair into synthetic fingerprint image
+    def validate_recipe(self, steps):
+        """
+
+        @brief: Checks if all recipe steps are supported, exits if not
+        :param steps: list of recipe steps
         :return: None
         """
-        for i in range(0, self.amount):
-            if self.args.type:
-                hair_type = self.args.type
-            else:
-                hair_type = random.choice(("long", "short"))
-            fingerprint = self.get_fingerprint_image()
-            hair_generator = HairGenerator(fingerprint)
-            if hair_type == "long":
-                hair_generator.generate_hair(HairLength.LONG)
-            elif hair_type == "short":
-                hair_generator.generate_hair(HairLength.SHORT)
-            self.save_image(hair_generator.background, i + 1)
+        error = self.get_recipe_error(steps)
+        if error is not None:
+            print(error)
+            os._exit(-1)
 
-    def get_arguments(self):
+    def validate_library_recipe(self, steps):
         """
 
-        @brief: Configures arguments
+        @brief: Checks if recipe can be stored in or applied from damage library, exits if not
+        :param steps: list of recipe steps
         :return: None
         """
-        if self.args.help:
-            print("PLACEHOLDER HELP")
-            os._exit(0)
+        if self.args.build_library and any(step.get("distortion") for step in steps):
+            print("Distortion of papillary lines can not be stored in damage library.")
+            os._exit(-1)
+        if self.args.library and not self.runner.get_library(self.args.library).find_entries(steps):
+            print(f"Damage library does not contain damage {','.join(step['damage'] for step in steps)} "
+                  f"with given parameters.")
+            os._exit(-1)
 
-        self.configure_basic_arguments()
-        self.get_damage_type()
+    def resolve_recipe_step(self, step):
+        """
 
-    @staticmethod
-    def choose_random_img_from_directory(directory):
+        @brief: Chooses parameters of recipe step which are not specified and parses them
+        :param step: recipe step as dictionary
+        :return: recipe step with all parameters specified
         """
+        if step["damage"] == "creases":
+            return {"damage": "creases", "level": step.get("level") or random.choice((1, 2, 3))}
 
-        @brief: Chooses random image from directory (if there are any valid valid images)
-        :param directory: path to directory
-        :return: Image as array
+        if step["damage"] == "scar":
+            distortion = bool(step.get("distortion"))
+            length = step.get("length") or random.choice(("long", "medium", "short"))
+            orientation = step.get("orientation") or random.choice(("horizontal", "vertical", "diagonal"))
+            # distortion is only supported for thin scars
+            if distortion:
+                width = "thin"
+            else:
+                width = step.get("width") or random.choice(("thin", "medium", "thick"))
+            return {"damage": "scar", "length": self.parse_scar_length(length),
+                    "orientation": self.parse_scar_orientation(orientation), "width": self.parse_scar_width(width),
+                    "outline": bool(step.get("outline")), "patches": bool(step.get("patches")),
+                    "distortion": distortion}
+
+        if step.get("type") == "long":
+            hair_length = HairLength.LONG
+        elif step.get("type") == "short":
+            hair_length = HairLength.SHORT
+        else:
+            hair_length = HairLength.RANDOM
+        if step.get("hair_count"):
+            min_count, max_count = self.parse_count_range(str(step["hair_count"]))
+        else:
+            min_count, max_count = 1, 1
+        return {"damage": "hair", "type": hair_length, "hair_count": random.randint(min_count, max_count)}
+
+    def load_jobs(self, path):
         """
-        # get all images from file
-        images = []
-        path = directory
-        valid_images = [".jpg", ".gif", ".png", ".tga"]
-        for file in os.listdir(path):
-            ext = os.path.splitext(file)[1]
-            if ext.lower() not in valid_images:
-                continue
-            images.append((os.path.join(path, file)))
 
-        if len(valid_images) == 0:
-            print("There are no valid images in directory")
+        @brief: Loads job manifest - JSON list of jobs. Every job is dictionary of arguments with the same names as
+                command line arguments (e.g. {"scar": true, "width": "thin", "amount": 10, "name": "scar", "seed": 1}),
+                arguments given on command line are used as defaults of all jobs
+        :param path: path to JSON file
+        :return: list of jobs as dictionaries
+        """
+        try:
+            with open(path) as jobs_file:
+                jobs = json.load(jobs_file)
+        except (OSError, ValueError) as exc:
+            print(f"Job manifest could not be loaded: {exc}")
+            os._exit(-1)
+        if not isinstance(jobs, list) or not all(isinstance(job, dict) for job in jobs):
+            print("Job manifest must be list of jobs.")
             os._exit(-1)
-        random_index = random.randrange(0, (len(images) - 1))
-        return images[random_index]
 
+        actions = {action.dest: action for action in self.parser._actions}
+        for job in jobs:
+            for key, value in job.items():
+                if key not in actions or key in NON_JOB_ARGUMENTS:
+                    print(f"Unknown argument in job manifest: {key}")
+                    os._exit(-1)
+                try:
+                    job[key] = self.convert_job_value(actions[key], value)
+                except ValueError:
+                    print(f"Invalid value of {key} in job manifest: {value}")
+                    os._exit(-1)
+        return jobs
+
+    @staticmethod
+    def convert_job_value(action, value):
+        """
+
+        @brief: Converts value of job manifest in the same way as value of command line argument is converted by
+                argparse - flags must be true or false, other values are converted by type of argument and checked
+                against its choices. Recipe can be also given as list of steps
+        :param action: argparse action of argument
+        :param value: value from job manifest
+        :return: converted value, raises ValueError if value is not valid
+        """
+        if value is None:
+            return None
+        if action.const is True:
+            if not isinstance(value, bool):
+                raise ValueError(value)
+            return value
+        if action.dest == "recipe" and isinstance(value, list):
+            return value
+        if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+            raise ValueError(value)
+        value = action.type(str(value))
+        if action.choices is not None and value not in action.choices:
+            raise ValueError(value)
+        return value
+
+    def run_jobs(self):
+        """
+
+        @brief: Runs all jobs of job manifest in this process, corpus index, template cache and worker pool are shared
+                by all jobs. Tasks of all jobs are generated as one batch, so workers are not idle between jobs
+        :return: None
+        """
+        jobs = self.load_jobs(self.args.jobs)
+        base_args = self.args
+        tasks = []
+        names = []
+        for index, job in enumerate(jobs):
+            self.args = argparse.Namespace(**{**vars(base_args), **job})
+            self.configure_basic_arguments()
+            for task in self.create_tasks():
+                task["job"] = index
+                tasks.append(task)
+            names.append(self.name or "damaged_fingerprint")
+        self.args = base_args
+
+        if self.args.plan:
+            self.plan_tasks(tasks)
+            return
+        start = time.perf_counter()
+        results = self.runner.run(tasks, self.get_cost_model(tasks))
+        for index, name in enumerate(names):
+            job_results = [result for result in results if result["job"] == index]
+            print(f"Job {index + 1}/{len(jobs)} ({name}): saved {sum(result['saved'] for result in job_results)}/"
+                  f"{len(job_results)} images")
+        print(f"Saved {sum(result['saved'] for result in results)}/{len(tasks)} images in "
+              f"{time.perf_counter() - start:.1f} s")
+
+    def get_arguments(self):
+        """
 
+        @brief: Configures arguments
+        :return: None
+        """
+        if self.args.help:
+            print("PLACEHOLDER HELP")
+            os._exit(0)
 
+        if self.args.profile or self.args.trace:
+            Profiler.enable(trace=bool(self.args.trace))
+        if self.args.metrics or self.args.metrics_prometheus:
+            Metrics.enable()
+        if self.args.progress_interval is not None and self.args.progress_interval <= 0:
+            print("Progress interval must be positive number.")
+            os._exit(-1)
+        if self.args.serve and (self.args.jobs or self.args.plan or self.args.build_library):
+            print("Server can not be combined with --jobs, --plan or --build-library.")
+            os._exit(-1)
+        if self.args.max_requests is not None and self.args.max_requests < 1:
+            print("Maximal amount of requests must be positive number.")
+            os._exit(-1)
+        self.runner = BatchRunner(self.args.workers or 1, self.args.progress_interval or DEFAULT_INTERVAL,
+                                  self.args.progress_json, self.args.backend or "process", self.args.shared_corpus)
+        try:
+            if self.args.jobs:
+                self.run_jobs()
+            elif self.args.serve:
+                self.configure_basic_arguments()
+                GenerationServer(self, self.args.max_requests or DEFAULT_MAX_REQUESTS).serve(self.args.serve)
+            else:
+                self.configure_basic_arguments()
+                self.get_damage_type()
+        finally:
+            self.runner.close()
+        if self.args.profile:
+            Profiler.active_profiler.save(self.args.profile)
+        if self.args.trace:
+            Profiler.active_profiler.save_trace(self.args.trace)
+        if self.args.metrics:
+            Metrics.active_registry.save(self.args.metrics)
+        if self.args.metrics_prometheus:
+            Metrics.active_registry.save(self.args.metrics_prometheus, prometheus=True)
@@ -0,0 +1,641 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Created By  : Vanessa Jóriová
+# Date        : 8.5.2022
+# Version     : 1.0
+
+import collections
+import io
+import itertools
+import multiprocessing
+import multiprocessing.pool
+import os
+import threading
+import time
+
+import cv2 as cv
+
+from PIL import Image
+from DamageLibrary import DamageLibrary
+from FingerprintImage import FingerprintImage
+from Generator import GenerationBudgetExceeded, create_random_generators
+from ScarGenerator import ScarGenerator
+from HairGenerator import HairGenerator
+from ProgressReporter import ProgressReporter, WorkerActivity, DEFAULT_INTERVAL
+from Profiler import span
+from Scheduler import Scheduler
+from SharedCorpus import SharedCorpus
+import Metrics
+import Profiler
+from WrinkleGenerator import WrinkleGenerator
+
+# amount of fingerprint templates tried before generated image is skipped
+TEMPLATE_ATTEMPTS = 3
+
+# amount of templates kept in template cache of every worker, the least recently used template is removed first
+TEMPLATE_CACHE_SIZE = 32
+
+VALID_IMAGE_EXTENSIONS = [".jpg", ".gif", ".png", ".tga"]
+
+# backends of pool of workers
+BACKENDS = ["process", "thread"]
+
+# formats of images returned instead of saved, raw image is returned as array
+OUTPUT_FORMATS = ["jpeg", "png", "raw"]
+
+# state of worker of pool - its BatchRunner instance (runner) and whether its profile and metrics records are sent to
+# main process (send_records), every worker thread has its own state
+worker_state = threading.local()
+
+
+def init_worker(profile=False, trace=False, metrics=False, activity=None, paths=()):
+    """
+
+    @brief: Initializes worker process of pool with its own BatchRunner
+    :param profile: True enables profiling in worker process
+    :param trace: True records spans for trace export
+    :param metrics: True enables metrics in worker process
+    :param activity: WorkerActivity of pool updated by worker
+    :param paths: paths to templates loaded into template cache of worker before the first task (at most
+                  TEMPLATE_CACHE_SIZE templates)
+    :return: None
+    """
+    worker_state.runner = BatchRunner()
+    worker_state.runner.set_activity(activity)
+    for path in paths[:TEMPLATE_CACHE_SIZE]:
+        worker_state.runner.get_template(path)
+    worker_state.send_records = True
+    if profile:
+        Profiler.enable(trace)
+    if metrics:
+        Metrics.enable()
+
+
+def init_thread_worker(runner):
+    """
+
+    @brief: Initializes worker thread of thread pool with its own BatchRunner, which shares corpus index, templates and
+            damage libraries with given runner. Profiler and metrics registry are shared by all threads of process, so
+            records are not sent
+    :param runner: BatchRunner instance owning thread pool
+    :return: None
+    """
+    worker_state.runner = BatchRunner()
+    worker_state.runner.corpus = runner.corpus
+    worker_state.runner.templates = runner.templates
+    worker_state.runner.template_lock = runner.template_lock
+    worker_state.runner.libraries = runner.libraries
+    worker_state.runner.set_activity(runner.activity)
+    worker_state.send_records = False
+
+
+def run_task_in_worker(task):
+    """
+
+    @brief: Generates and saves image of given task in worker process
+    :param task: task as dictionary
+    :return: result of task (see BatchRunner.execute_task) with profile and metrics records of worker (None if
+             profiling or metrics are disabled or worker is thread)
+    """
+    result = worker_state.runner.execute_task(task)
+    result["profile"] = None
+    result["metrics"] = None
+    if worker_state.send_records and Profiler.active_profiler is not None:
+        result["profile"] = Profiler.active_profiler.take_records()
+    if worker_state.send_records and Metrics.active_registry is not None:
+        result["metrics"] = Metrics.active_registry.take_records()
+    return result
+
+
+def run_unit_in_worker(unit):
+    """
+
+    @brief: Generates and saves all tasks of work unit in worker
+    :param unit: descriptions of shared templates used by tasks (see SharedCorpus, empty if corpus is not shared) and
+                 list of tasks
+    :return: list of results of tasks (see run_task_in_worker)
+    """
+    templates, tasks = unit
+    worker_state.runner.attach_templates(templates)
+    return [run_task_in_worker(task) for task in tasks]
+
+
+class BatchRunner:
+    """
+    Class generating damaged fingerprint images from tasks. Every task is dictionary describing one output image:
+        :number          number of image used in its name
+        :name            name of image
+        :save_folder     folder in which image is saved
+        :image           path to fingerprint template or None
+        :directory       directory with fingerprint templates used if image is None
+        :seed            seed of random generators
+        :max_attempts    attempt budget of sampling stages (None for default)
+        :time_budget     time budget of sampling stages (None for default)
+        :steps           list of resolved damage steps applied in sequence, requested (unresolved) steps in case of
+                         library
+        :library         path to damage library from which layer is applied instead of rendering damage, or None
+        :build_library   path to damage library into which rendered damage is saved instead of image, or None
+        :job             index of job of job manifest, 0 if manifest is not used
+        :output          None saves image into save_folder, format from OUTPUT_FORMATS returns image in result of task
+        :damage_mask     True returns also mask of pixels covered by damage (only if image is returned)
+    Corpus index of directories, loaded templates with their masks (up to TEMPLATE_CACHE_SIZE templates) and damage
+    libraries are cached, so they are shared by all batches generated by the same instance
+    """
+
+    def __init__(self, workers=1, progress_interval=DEFAULT_INTERVAL, progress_json=None, backend="process",
+                 shared_corpus=False):
+        """
+
+        :param workers: amount of workers, with one worker images are generated in current thread
+        :param progress_interval: interval of progress reports in seconds
+        :param progress_json: path to file to which progress is written as JSON lines ("-" for standard output), None
+                              prints progress as text
+        :param backend: "process" generates images in pool of worker processes, "thread" in pool of threads of this
+                        process, which share loaded templates (OpenCV releases GIL during image operations)
+        :param shared_corpus: True loads templates in this process and shares them with worker processes through shared
+                              memory (see SharedCorpus)
+        """
+        self.workers = workers
+        self.backend = backend
+        self.progress_interval = progress_interval
+        self.progress_json = progress_json
+        self.pool = None
+        self.corpus = {}
+        self.templates = collections.OrderedDict()
+        self.template_lock = threading.Lock()
+        self.libraries = {}
+        self.max_attempts = None
+        self.time_budget = None
+        self.rng = None
+        self.output = None
+        self.activity = None
+        self.activity_slot = None
+        self.shared_corpus = SharedCorpus() if shared_corpus and backend == "process" and workers > 1 else None
+
+    def set_activity(self, activity):
+        """
+
+        @brief: Sets activity of workers which is updated when this runner starts and finishes task
+        :param activity: WorkerActivity instance or None
+        :return: None
+        """
+        self.activity = activity
+        self.activity_slot = activity.register_worker() if activity is not None else None
+
+    def get_corpus(self, directory):
+        """
+
+        @brief: Gets paths of all valid images in directory, directory is listed only once
+        :param directory: path to directory
+        :return: list of paths to images
+        """
+        if directory not in self.corpus:
+            images = []
+            for file in sorted(os.listdir(directory)):
+                ext = os.path.splitext(file)[1]
+                if ext.lower() in VALID_IMAGE_EXTENSIONS:
+                    images.append(os.path.join(directory, file))
+            if len(images) == 0:
+                print("There are no valid images in directory")
+                os._exit(-1)
+            self.corpus[directory] = images
+        return self.corpus[directory]
+
+    @staticmethod
+    def load_template(path):
+        """
+
+        @brief: Loads fingerprint template and computes its mask, size and fingerprint pixels
+        :param path: path to image
+        :return: FingerprintImage instance
+        """
+        template = FingerprintImage()
+        with span("load"):
+            template.load_file_from_path(path)
+        with span("mask"):
+            template.create_mask()
+            template.get_fingerprint_size()
+            template.get_fingerprint_pixels()
+        return template
+
+    def cache_template(self, path, template):
+        """
+
+        @brief: Adds template to template cache, the least recently used templates are removed if cache has more than
+                TEMPLATE_CACHE_SIZE templates
+        :param path: path to image
+        :param template: FingerprintImage instance
+        :return: None
+        """
+        with self.template_lock:
+            self.templates[path] = template
+            self.templates.move_to_end(path)
+            while len(self.templates) > TEMPLATE_CACHE_SIZE:
+                self.templates.popitem(last=False)
+
+    def get_template(self, path):
+        """
+
+        @brief: Gets fingerprint template with computed mask, size and fingerprint pixels. Template is loaded only once
+                while it stays in template cache
+        :param path: path to image
+        :return: FingerprintImage instance, must not be changed
+        """
+        with self.template_lock:
+            template = self.templates.get(path)
+            if template is not None:
+                self.templates.move_to_end(path)
+                return template
+        template = self.load_template(path)
+        self.cache_template(path, template)
+        return template
+
+    def attach_templates(self, templates):
+        """
+
+        @brief: Adds templates shared by main process to template cache of worker
+        :param templates: dictionary path -> description of shared template
+        :return: None
+        """
+        for path, description in templates.items():
+            if path not in self.templates:
+                self.cache_template(path, SharedCorpus.attach(description))
+
+    def share_templates(self, tasks):
+        """
+
+        @brief: Loads templates of tasks which are not shared yet and copies them into shared memory. Templates are not
+                kept in template cache of this process, so only shared copy of template stays in memory
+        :param tasks: list of tasks
+        :return: dictionary path -> description of shared template
+        """
+        paths = {task["image"] for task in tasks if task["image"] is not None}
+        return {path: self.shared_corpus.descriptions.get(path) or self.shared_corpus.share(self.load_template(path))
+                for path in paths}
+
+    def get_library(self, directory):
+        """
+
+        @brief: Gets damage library, library index is loaded only once
+        :param directory: path to library directory
+        :return: DamageLibrary instance
+        """
+        if directory not in self.libraries:
+            self.libraries[directory] = DamageLibrary(directory)
+        return self.libraries[directory]
+
+    def get_fingerprint_image(self, image, directory):
+        """
+
+        @brief: Chooses fingerprint in which damage will be generated - given image or random image from directory
+        :param image: path to image or None
+        :param directory: path to directory with images used if image is None
+        :return: copy of cached FingerprintImage which can be damaged
+        """
+        if image is None:
+            image = self.rng[0].choice(self.get_corpus(directory))
+        template = self.get_template(image)
+        with span("load"):
+            return template.copy()
+
+    def configure_budget(self, generator):
+        """
+
+        @brief: Sets sampling budget of current task to generator
+        :param generator: generator instance
+        :return: None
+        """
+        generator.set_budget(self.max_attempts, self.time_budget)
+
+    def create_creases(self, fingerprint, level):
+        """
+
+        @brief: Generates creases of given level into fingerprint
+        :param fingerprint: FingerprintImage instance with loaded image
+        :param level: level of creases (1-3)
+        :return: generated image as array
+        """
+        wrinkle_generator = WrinkleGenerator(fingerprint, self.rng)
+        self.configure_budget(wrinkle_generator)
+        if level == 1:
+            wrinkle_generator.wrinkles_level_1()
+        elif level == 2:
+            wrinkle_generator.wrinkles_level_2()
+        else:
+            wrinkle_generator.wrinkles_level_3()
+        return wrinkle_generator.generated_image
+
+    def create_scar(self, fingerprint, scar_length, scar_orientation, scar_width, outline=False, patches=False,
+                    distortion=False):
+        """
+
+        @brief: Generates scar of given parameters into fingerprint
+        :param fingerprint: FingerprintImage instance with loaded image
+        :param scar_length: LineLength enum instance
+        :param scar_orientation: LineOrientation enum instance
+        :param scar_width: LineThickness enum instance
+        :param outline: True generates black outline of scar
+        :param patches: True generates black artifacts in scar
+        :param distortion: True distorts papillary lines around scar
+        :return: generated image as array
+        """
+        scar_generator = ScarGenerator(fingerprint, self.rng)
+        self.configure_budget(scar_generator)
+
+        if outline:
+            scar_generator.black_outline = True
+        if patches:
+            scar_generator.artifacts = True
+        if distortion:
+            scar_generator.distortion = True
+
+        scar_generator.generate_line(scar_length, scar_orientation, scar_width)
+        return scar_generator.background
+
+    def create_hair(self, fingerprint, hair_length, hair_count):
+        """
+
+        @brief: Generates hair of given length into fingerprint
+        :param fingerprint: FingerprintImage instance with loaded image
+        :param hair_length: HairLength enum instance, in case of RANDOM length is chosen for every hair
+        :param hair_count: amount of hair
+        :return: generated image as array
+        """
+        hair_generator = HairGenerator(fingerprint, self.rng)
+        self.configure_budget(hair_generator)
+        hair_generator.generate_hair(hair_length, hair_count)
+        return hair_generator.background
+
+    def create_recipe(self, fingerprint, steps):
+        """
+
+        @brief: Applies all damage steps in sequence to the same fingerprint. Every step starts from image damaged by
+                previous steps and reuses mask of fingerprint
+        :param fingerprint: FingerprintImage instance with loaded image
+        :param steps: resolved damage steps
+        :return: generated image as array
+        """
+        for step in steps:
+            if step["damage"] == "creases":
+                image = self.create_creases(fingerprint, step["level"])
+            elif step["damage"] == "scar":
+                image = self.create_scar(fingerprint, step["length"], step["orientation"], step["width"],
+                                         step["outline"], step["patches"], step["distortion"])
+            else:
+                image = self.create_hair(fingerprint, step["type"], step["hair_count"])
+            fingerprint.set_img(image)
+        return fingerprint.img
+
+    def generate_with_fallback(self, task):
+        """
+
+        @brief: Generates damage of task into fingerprint template. If damage can not be generated within sampling
+                budget, another template is chosen (the same template if task has no directory), after
+                TEMPLATE_ATTEMPTS failed templates the image is skipped
+        :param task: task as dictionary
+        :return: damaged FingerprintImage instance, None if image was skipped
+        """
+        image = task["image"]
+        for attempt in range(0, TEMPLATE_ATTEMPTS):
+            fingerprint = self.get_fingerprint_image(image, task["directory"])
+            if task["build_library"] is not None or task["damage_mask"]:
+                fingerprint.start_damage_record()
+            try:
+                self.create_recipe(fingerprint, task["steps"])
+                return fingerprint
+            except GenerationBudgetExceeded as exc:
+                print(f"Damage could not be generated into {fingerprint.path}: {exc}, "
+                      f"attempts: {exc.attempt_counters}")
+                # template chosen for variants is replaced by random template from directory
+                if task["directory"] is not None:
+                    image = None
+        print(f"Skipping image, damage could not be generated into {TEMPLATE_ATTEMPTS} templates")
+        return None
+
+    def apply_library(self, task):
+        """
+
+        @brief: Applies randomly chosen layer of damage library matching requested steps to fingerprint template
+        :param task: task as dictionary
+        :return: damaged FingerprintImage instance
+        """
+        library = self.get_library(task["library"])
+        fingerprint = self.get_fingerprint_image(task["image"], task["directory"])
+        if task["damage_mask"]:
+            fingerprint.start_damage_record()
+        entry = self.rng[0].choice(library.find_entries(task["steps"]))
+        fingerprint.set_img(library.apply_layer(fingerprint, entry, self.rng))
+        return fingerprint
+
+    @staticmethod
+    def encode_image(image, image_format="jpeg"):
+        """
+
+        @brief: Encodes image in the same way as saved images
+        :param image: image as array
+        :param image_format: jpeg or png
+        :return: encoded image as bytes
+        """
+        with span("encode"):
+            image = cv.cvtColor(image, cv.COLOR_GRAY2RGB)
+            pil_image = Image.fromarray(image)
+            encoded = io.BytesIO()
+            pil_image.save(encoded, format=image_format.upper(), dpi=(120, 120))
+            return encoded.getvalue()
+
+    @staticmethod
+    def save_image(image, save_folder, name, number):
+        """
+
+        @brief: Saves image in JPG format
+        :param image: Image that will be saved as array
+        :param save_folder: Folder in which image is saved
+        :param name: Name of image
+        :param number: Number of generated images as integer
+        :return: None
+        """
+        image_name = name + str(number) + '.JPG'
+        encoded = BatchRunner.encode_image(image)
+        with span("write"):
+            with open(os.path.join(save_folder, image_name), "wb") as image_file:
+                image_file.write(encoded)
+
+    @staticmethod
+    def get_layer_name(task):
+        """
+
+        @brief: Creates name of damage layer saved into library, name contains damage types and seed of task, so layers
+                of several builds into the same library do not share names
+        :param task: task as dictionary
+        :return: name of layer file without extension
+        """
+        damage = "+".join(step["damage"] for step in task["steps"])
+        return f"{task['name']}{task['number']}_{damage}_{task['seed']:08x}"
+
+    def run_task(self, task):
+        """
+
+        @brief: Generates and saves image of given task. If task requests output, image is not saved but stored in
+                output of runner
+        :param task: task as dictionary
+        :return: True if image was saved, False if it was skipped
+        """
+        self.rng = create_random_generators(task["seed"])
+        self.output = None
+        self.max_attempts = task["max_attempts"]
+        self.time_budget = task["time_budget"]
+
+        if Profiler.active_profiler is not None:
+            Profiler.active_profiler.start_image(task["name"] + str(task["number"]),
+                                                 DamageLibrary.describe_steps(task["steps"]),
+                                                 task["library"] is not None)
+        if Metrics.active_registry is not None:
+            Metrics.active_registry.start_image(task["name"] + str(task["number"]),
+                                                DamageLibrary.describe_steps(task["steps"]))
+        try:
+            if task["library"] is not None:
+                fingerprint = self.apply_library(task)
+            else:
+                fingerprint = self.generate_with_fallback(task)
+                if fingerprint is None:
+                    return False
+                if task["build_library"] is not None:
+                    with span("write"):
+                        return DamageLibrary.save_layer(task["build_library"], self.get_layer_name(task), fingerprint,
+                                                        task["steps"])
+            if task["output"] is not None:
+                self.output = {"image": fingerprint.img if task["output"] == "raw" else
+                               self.encode_image(fingerprint.img, task["output"]),
+                               "damage_mask": fingerprint.damage_mask if task["damage_mask"] else None,
+                               "template": fingerprint.path}
+                return True
+            self.save_image(fingerprint.img, task["save_folder"], task["name"], task["number"])
+            return True
+        finally:
+            if Profiler.active_profiler is not None:
+                Profiler.active_profiler.finish_image()
+            if Metrics.active_registry is not None:
+                Metrics.active_registry.finish_image()
+
+    def execute_task(self, task):
+        """
+
+        @brief: Generates and saves image of given task and measures its time. Error of task which returns image is
+                returned in result, so it does not fail other tasks of batch, error of other tasks is raised
+        :param task: task as dictionary
+        :return: result of task as dictionary - saved (True if image was saved), damage (damage types of image joined
+                 by +), seconds (time of task), job and number of task, output (requested image, its damage mask
+                 and path of its template, None if image is saved or skipped) and error (description of error of task
+                 or None)
+        """
+        if self.activity is not None:
+            self.activity.task_started(self.activity_slot)
+        start = time.perf_counter()
+        error = None
+        try:
+            saved = self.run_task(task)
+        except Exception as exc:
+            if task["output"] is None:
+                raise
+            saved, error = False, repr(exc)
+            self.output = None
+        finally:
+            seconds = time.perf_counter() - start
+            if self.activity is not None:
+                self.activity.task_finished(self.activity_slot, seconds)
+        return {"saved": saved, "damage": "+".join(step["damage"] for step in task["steps"]),
+                "seconds": seconds, "job": task["job"], "number": task["number"], "output": self.output,
+                "error": error}
+
+    def run(self, tasks, cost_model=None):
+        """
+
+        @brief: Generates all tasks. With more than one worker tasks are generated by pool of worker processes or
+                threads, which is created once and reused by all following batches. Tasks are sent to workers in work
+                units ordered by their estimated cost (see Scheduler), together with shared templates of unit
+        :param tasks: list of tasks
+        :param cost_model: CostModel instance estimating cost of tasks, None uses default costs
+        :return: list of results of tasks in order in which they were finished
+        """
+        if self.workers <= 1:
+            if self.activity is None:
+                self.set_activity(WorkerActivity(1))
+            self.activity.reset()
+            results = map(self.execute_task, tasks)
+        else:
+            self.start_pool()
+            self.activity.reset()
+            units = Scheduler(self.workers, cost_model).create_units(tasks)
+            if self.shared_corpus is not None:
+                units = [(self.share_templates(unit), unit) for unit in units]
+            else:
+                units = [({}, unit) for unit in units]
+            results = itertools.chain.from_iterable(self.pool.imap_unordered(run_unit_in_worker, units))
+
+        reporter = ProgressReporter(len(tasks), self.workers, self.progress_interval, self.progress_json,
+                                    self.activity)
+        reporter.start()
+        finished = []
+        try:
+            for result in results:
+                finished.append(result)
+                reporter.task_done(result)
+                if result.get("profile"):
+                    Profiler.active_profiler.add_records(result["profile"])
+                if result.get("metrics"):
+                    Metrics.active_registry.add_records(result["metrics"])
+        finally:
+            reporter.finish()
+        return finished
+
+    def start_pool(self, paths=()):
+        """
+
+        @brief: Starts pool of workers if it is not running, pool is not used with one worker
+        :param paths: paths to templates loaded by every worker process when it starts
+        :return: None
+        """
+        if self.workers <= 1 or self.pool is not None:
+            return
+        self.activity = WorkerActivity(self.workers)
+        if self.backend == "thread":
+            self.pool = multiprocessing.pool.ThreadPool(self.workers, initializer=init_thread_worker, initargs=(self,))
+        else:
+            profiler = Profiler.active_profiler
+            self.pool = multiprocessing.Pool(self.workers, initializer=init_worker,
+                                             initargs=(profiler is not None, profiler is not None and profiler.trace,
+                                                       Metrics.active_registry is not None, self.activity, paths))
+
+    def warm_up(self, paths):
+        """
+
+        @brief: Loads templates and starts pool of workers before the first batch. Shared corpus gets all templates,
+                otherwise at most TEMPLATE_CACHE_SIZE templates are loaded into template cache of process which uses
+                them - this process (one worker or thread pool) or every worker process
+        :param paths: paths to templates
+        :return: None
+        """
+        paths = list(paths)
+        if self.shared_corpus is not None:
+            self.share_templates([{"image": path} for path in paths])
+            self.start_pool()
+        elif self.workers <= 1 or self.backend == "thread":
+            for path in paths[:TEMPLATE_CACHE_SIZE]:
+                self.get_template(path)
+            self.start_pool()
+        else:
+            self.start_pool(paths)
+
+    def close(self):
+        """
+
+        @brief: Stops workers of pool and releases shared templates
+        :return: None
+        """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        if self.shared_corpus is not None:
+            self.shared_corpus.close()
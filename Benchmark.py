@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Created By  : Vanessa Jóriová
+# Date        : 8.5.2022
+# Version     : 1.0
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import cv2 as cv
+import numpy as np
+
+from BatchRunner import BatchRunner
+from FingerprintImage import FingerprintImage
+from Generator import GenerationBudgetExceeded
+from HairGenerator import HairGenerator, HairLength
+from LineGenerator import LineGenerator, LineLength, LineOrientation, LineThickness
+from ScarGenerator import ScarGenerator
+from WrinkleGenerator import WrinkleGenerator
+
+# default sizes of synthetic fingerprints as (width, height)
+DEFAULT_SIZES = [(288, 384), (416, 560), (640, 864)]
+
+# relative change of median time reported as regression or improvement by comparison
+DEFAULT_THRESHOLD = 0.1
+
+PERCENTILES = [50, 90, 99]
+
+
+def create_synthetic_fingerprint(width, height):
+    """
+
+    @brief: Creates fingerprint-like image - elliptic area of curved black and white ridges on white background
+    :param width: width of image
+    :param height: height of image
+    :return: greyscale image as array
+    """
+    yy, xx = np.mgrid[0:height, 0:width]
+    period = max(width, height) / 60
+    ridges = np.sin((xx + np.sin(yy / height * 6) * width / 20) / period + yy / period / 3) > 0
+    area = ((xx - width / 2) / (width * 0.4)) ** 2 + ((yy - height / 2) / (height * 0.42)) ** 2 < 1
+    image = np.full((height, width), 255, np.uint8)
+    image[area & ridges] = 0
+    return image
+
+
+def create_fingerprint(image):
+    """
+
+    @brief: Creates fingerprint with computed mask and size from image, image is copied
+    :param image: greyscale image as array
+    :return: FingerprintImage instance
+    """
+    fingerprint = FingerprintImage()
+    fingerprint.set_img(image.copy())
+    fingerprint.create_mask()
+    fingerprint.get_fingerprint_size()
+    return fingerprint
+
+
+def prepare_scar(image, thickness=LineThickness.RANDOM, thicken=False, edges=False):
+    """
+
+    @brief: Creates scar generator with sampled line geometry (same steps as ScarGenerator.generate_line)
+    :param image: greyscale image as array
+    :param thickness: LineThickness enum value
+    :param thicken: True thickens line
+    :param edges: True also draws irregular edges
+    :return: ScarGenerator instance
+    """
+    scar_generator = ScarGenerator(create_fingerprint(image))
+    scar_generator.set_line_type(LineLength.RANDOM, LineOrientation.RANDOM, thickness)
+    scar_generator.damage_canvas = scar_generator.create_damage_canvas()
+    scar_generator.sample_control_points(scar_generator.more_than_one_point_outside)
+    for i in range(0, random.randrange(1, 4)):
+        scar_generator.add_width_points()
+    if thicken:
+        scar_generator.thicken_line()
+    if edges:
+        scar_generator.irregular_edges()
+    return scar_generator
+
+
+def prepare_line(image):
+    """
+
+    @brief: Creates line generator with chosen line type and empty damage canvas
+    :param image: greyscale image as array
+    :return: LineGenerator instance
+    """
+    line_generator = LineGenerator(create_fingerprint(image))
+    line_generator.set_line_type(LineLength.RANDOM, LineOrientation.RANDOM, LineThickness.RANDOM)
+    line_generator.damage_canvas = line_generator.create_damage_canvas()
+    return line_generator
+
+
+def prepare_hair(image):
+    """
+
+    @brief: Creates hair generator with sampled start, end and control point of hair
+    :param image: greyscale image as array
+    :return: hair generator and points of bezier curve
+    """
+    hair_generator = HairGenerator(create_fingerprint(image))
+    hair_generator.set_length_type(HairLength.RANDOM)
+    return hair_generator, hair_generator.get_start_end_and_control_point()
+
+
+def save_image(image, folder):
+    """
+
+    @brief: Saves image the same way as generated images are saved
+    :param image: greyscale image as array
+    :param folder: folder in which image is saved
+    :return: None
+    """
+    BatchRunner.save_image(image, folder, "benchmark", 1)
+
+
+# every stage is (name, setup, run) - setup prepares state from synthetic image and is not measured, run is measured
+STAGES = [
+    ("mask", lambda image: create_fingerprint(image), lambda fingerprint: fingerprint.create_mask()),
+    ("line_geometry", prepare_line,
+     lambda generator: generator.sample_control_points(generator.half_points_outside, 1)),
+    ("thicken_line", lambda image: prepare_scar(image), lambda generator: generator.thicken_line()),
+    ("irregular_edges", lambda image: prepare_scar(image, thicken=True),
+     lambda generator: generator.irregular_edges()),
+    ("artifacts", lambda image: prepare_scar(image, thicken=True, edges=True),
+     lambda generator: generator.generate_artifacts(patch_center=True)),
+    ("outline", lambda image: prepare_scar(image, thicken=True, edges=True),
+     lambda generator: generator.draw_black_outline()),
+    ("soak_distortion", lambda image: prepare_scar(image, LineThickness.THIN, thicken=True, edges=True),
+     lambda generator: generator.distort_edges()),
+    ("hair_bezier", prepare_hair, lambda prepared: prepared[0].quadratic_bezier(*prepared[1])),
+    ("wrinkles_level_1", lambda image: WrinkleGenerator(create_fingerprint(image)),
+     lambda generator: generator.wrinkles_level_1()),
+    ("wrinkles_level_2", lambda image: WrinkleGenerator(create_fingerprint(image)),
+     lambda generator: generator.wrinkles_level_2()),
+    ("wrinkles_level_3", lambda image: WrinkleGenerator(create_fingerprint(image)),
+     lambda generator: generator.wrinkles_level_3()),
+    ("save", lambda image: image, None),
+]
+
+
+class Benchmark:
+    """
+    Class measuring time and peak memory of generator stages on synthetic fingerprints of several sizes. Peak memory
+    is measured by tracemalloc, so it contains only memory allocated through Python allocator (Python objects and NumPy
+    arrays), native buffers allocated by OpenCV are not included
+    """
+
+    def __init__(self, sizes=None, repeat=10, seed=0, stages=None):
+        """
+
+        :param sizes: list of image sizes as (width, height)
+        :param repeat: amount of measured runs of every stage and size
+        :param seed: seed of random generators, every stage and size starts from the same seed
+        :param stages: names of measured stages, None measures all stages
+        """
+        self.sizes = sizes or DEFAULT_SIZES
+        self.repeat = repeat
+        self.seed = seed
+        self.stages = [stage for stage in STAGES if stages is None or stage[0] in stages]
+        self.save_folder = None
+
+    def measure_stage(self, name, setup, run, image):
+        """
+
+        @brief: Measures stage on given image. Every run gets new state from setup. Time is measured in all runs, peak
+                Python heap memory is measured in one additional run with tracemalloc, so tracing does not affect times
+        :param name: name of stage
+        :param setup: function preparing state from image
+        :param run: function running stage on prepared state
+        :param image: synthetic fingerprint image
+        :return: dictionary with results
+        """
+        if run is None:
+            run = lambda state: save_image(state, self.save_folder)
+
+        random.seed(self.seed)
+        np.random.seed(self.seed)
+        times = []
+        failed = 0
+        peak_memory = None
+        for i in range(0, self.repeat + 1):
+            try:
+                state = setup(image)
+                if i == self.repeat:
+                    tracemalloc.start()
+                start = time.perf_counter()
+                run(state)
+                elapsed = time.perf_counter() - start
+            except GenerationBudgetExceeded:
+                failed += 1
+                continue
+            finally:
+                if tracemalloc.is_tracing():
+                    peak_memory = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+            if i < self.repeat:
+                times.append(elapsed)
+
+        result = {"stage": name, "size": [image.shape[1], image.shape[0]], "runs": len(times), "failed": failed}
+        if times:
+            result["mean_s"] = float(np.mean(times))
+            for percentile in PERCENTILES:
+                result[f"p{percentile}_s"] = float(np.percentile(times, percentile))
+            result["ops_per_s"] = 1 / result["mean_s"] if result["mean_s"] > 0 else None
+        if peak_memory is not None:
+            result["peak_memory_bytes"] = peak_memory
+        return result
+
+    def run(self):
+        """
+
+        @brief: Measures all stages on all sizes
+        :return: results as dictionary
+        """
+        results = {}
+        with tempfile.TemporaryDirectory() as save_folder:
+            self.save_folder = save_folder
+            for width, height in self.sizes:
+                image = create_synthetic_fingerprint(width, height)
+                for name, setup, run in self.stages:
+                    result = self.measure_stage(name, setup, run, image)
+                    results[f"{name}@{width}x{height}"] = result
+                    print(self.format_result(result))
+        return {
+            "meta": {"python": platform.python_version(), "numpy": np.__version__, "opencv": cv.__version__,
+                     "machine": platform.machine(), "repeat": self.repeat, "seed": self.seed,
+                     "created": time.strftime("%Y-%m-%d %H:%M:%S")},
+            "results": results,
+        }
+
+    @staticmethod
+    def format_result(result):
+        """
+
+        @brief: Formats result of stage as one line of text
+        :param result: result of stage
+        :return: formatted result as string
+        """
+        size = f"{result['size'][0]}x{result['size'][1]}"
+        if result["runs"] == 0:
+            return f"{result['stage']:<18}{size:>10}  all {result['failed']} runs failed"
+        text = f"{result['stage']:<18}{size:>10}  {result['ops_per_s']:>10.1f} ops/s"
+        for percentile in PERCENTILES:
+            text += f"  p{percentile} {result[f'p{percentile}_s'] * 1000:>9.2f} ms"
+        text += f"  python heap peak {result.get('peak_memory_bytes', 0) / 2 ** 20:>7.2f} MiB"
+        if result["failed"]:
+            text += f"  failed {result['failed']}"
+        return text
+
+
+def compare(baseline_path, current_path, threshold=DEFAULT_THRESHOLD):
+    """
+
+    @brief: Compares median times and peak Python heap memory of stages measured in two runs and prints changes
+    :param baseline_path: path to JSON file with baseline results
+    :param current_path: path to JSON file with current results
+    :param threshold: relative change of median time reported as regression or improvement
+    :return: amount of regressions
+    """
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)["results"]
+    with open(current_path) as current_file:
+        current = json.load(current_file)["results"]
+
+    regressions = 0
+    for key in baseline:
+        if key not in current or "p50_s" not in baseline[key] or "p50_s" not in current[key]:
+            continue
+        change = current[key]["p50_s"] / baseline[key]["p50_s"] - 1 if baseline[key]["p50_s"] > 0 else 0
+        if change > threshold:
+            verdict = "SLOWER"
+            regressions += 1
+        elif change < -threshold:
+            verdict = "faster"
+        else:
+            verdict = ""
+        memory_change = current[key].get("peak_memory_bytes", 0) - baseline[key].get("peak_memory_bytes", 0)
+        print(f"{key:<30} p50 {baseline[key]['p50_s'] * 1000:>9.2f} ms -> {current[key]['p50_s'] * 1000:>9.2f} ms "
+              f"({change:+7.1%})  python heap peak {memory_change / 2 ** 20:+7.2f} MiB  {verdict}")
+    for key in current:
+        if key not in baseline:
+            print(f"{key:<30} not in baseline")
+    return regressions
+
+
+def parse_sizes(sizes):
+    """
+
+    @brief: Parses list of image sizes
+    :param sizes: comma separated sizes in WIDTHxHEIGHT format as string, e.g. 288x384,640x864
+    :return: list of sizes as (width, height)
+    """
+    try:
+        parsed = [tuple(int(value) for value in size.split("x")) for size in sizes.split(",")]
+    except ValueError:
+        parsed = []
+    if not parsed or any(len(size) != 2 or min(size) < 150 for size in parsed):
+        print("Sizes must be comma separated list in WIDTHxHEIGHT format, both sides at least 150 px.")
+        sys.exit(-1)
+    return parsed
+
+
+def main():
+    """
+
+    @brief: Runs benchmark or compares results of two benchmark runs
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description="Benchmark of damage generators on synthetic fingerprints")
+    parser.add_argument("--output", "-o", action="store", type=str, dest="output",
+                        help="JSON file in which results are saved")
+    parser.add_argument("--repeat", action="store", type=int, default=10, dest="repeat")
+    parser.add_argument("--sizes", action="store", type=str, dest="sizes", help="e.g. 288x384,640x864")
+    parser.add_argument("--stages", action="store", type=str, dest="stages",
+                        help="comma separated stages: " + ",".join(stage[0] for stage in STAGES))
+    parser.add_argument("--seed", action="store", type=int, default=0, dest="seed")
+    parser.add_argument("--compare", action="store", nargs=2, metavar=("BASELINE", "CURRENT"), dest="compare")
+    parser.add_argument("--threshold", action="store", type=float, default=DEFAULT_THRESHOLD, dest="threshold")
+    args = parser.parse_args()
+
+    if args.compare:
+        regressions = compare(args.compare[0], args.compare[1], args.threshold)
+        sys.exit(1 if regressions else 0)
+
+    stages = None
+    if args.stages:
+        stages = args.stages.split(",")
+        unknown = set(stages) - {stage[0] for stage in STAGES}
+        if unknown:
+            print(f"Unknown stages: {', '.join(sorted(unknown))}")
+            sys.exit(-1)
+    sizes = parse_sizes(args.sizes) if args.sizes else None
+
+    results = Benchmark(sizes, args.repeat, args.seed, stages).run()
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Created By  : Vanessa Jóriová
+# Date        : 8.5.2022
+# Version     : 1.0
+
+import json
+import math
+import os
+
+from DamageLibrary import DamageLibrary
+
+# default costs in seconds measured on fingerprint of size 416x560, used if cost model is not calibrated
+DEFAULT_COSTS = {
+    "image": 0.01,              # copy of template, encoding and writing of image
+    "template": 0.005,          # loading and masking of template, done once per template and worker
+    "worker_startup": 0.3,      # start of worker process
+    "library": 0.005,           # application of damage layer from library
+    "creases/level1": 0.03,
+    "creases/level2": 0.035,
+    "creases/level3": 0.085,
+    "scar": 0.015,              # line geometry, thickening and irregular edges
+    "scar/outline": 0.004,
+    "scar/patches": 0.006,
+    "scar/distortion": 1.5,
+    "hair": 0.005,              # cost of one hair
+}
+
+# estimated time of worker count within this ratio of the best estimated time is good enough
+WORKER_TOLERANCE = 1.1
+
+# stages of profile which are not part of damage generation
+OVERHEAD_STAGES = ["load", "encode", "write"]
+
+
+def get_step_key(step):
+    """
+
+    @brief: Gets configuration key of damage step, steps with the same key have similar cost
+    :param step: damage step as JSON serializable dictionary (e.g. described by DamageLibrary.describe_steps)
+    :return: key as string, e.g. creases/level2, scar/long/thin/distortion or hair/short
+    """
+    if step["damage"] == "creases":
+        return f"creases/level{step['level']}"
+    if step["damage"] == "scar":
+        key = f"scar/{step['length']}/{step['width']}"
+        for flag in ("outline", "patches", "distortion"):
+            if step.get(flag):
+                key += "/" + flag
+        return key
+    return f"hair/{step['type']}"
+
+
+class CostModel:
+    """
+    Cost model estimating time of generating images from their damage configuration. Costs are learned as mean time
+    of every step configuration (e.g. scar/long/thin/distortion) and of every whole recipe. Configurations without
+    measurement are estimated from default costs, which can be calibrated by benchmark results
+    """
+
+    def __init__(self):
+        self.costs = dict(DEFAULT_COSTS)
+        self.samples = {}
+
+    def add_sample(self, key, seconds):
+        """
+
+        @brief: Adds measured time of configuration
+        :param key: configuration key
+        :param seconds: measured time in seconds
+        :return: None
+        """
+        self.samples.setdefault(key, []).append(seconds)
+
+    def get_learned_cost(self, key):
+        """
+
+        @brief: Gets mean measured time of configuration
+        :param key: configuration key
+        :return: time in seconds, None if configuration was not measured
+        """
+        if key not in self.samples:
+            return None
+        return sum(self.samples[key]) / len(self.samples[key])
+
+    def load(self, path, image_size=None):
+        """
+
+        @brief: Calibrates cost model by results of Benchmark.py or profile saved by --profile
+        :param path: path to JSON file
+        :param image_size: (width, height) of generated images used to choose size of benchmark results
+        :return: None
+        """
+        try:
+            with open(path) as cost_file:
+                data = json.load(cost_file)
+        except (OSError, ValueError) as exc:
+            print(f"Cost model could not be loaded: {exc}")
+            os._exit(-1)
+        if "results" in data:
+            self.calibrate_from_benchmark(data["results"], image_size)
+        elif "images" in data:
+            self.calibrate_from_profile(data["images"])
+        else:
+            print("Cost model must be result of benchmark or profile.")
+            os._exit(-1)
+
+    def calibrate_from_benchmark(self, results, image_size=None):
+        """
+
+        @brief: Sets default costs from median times of benchmark stages measured on size closest to size of generated
+                images. Benchmark measures only Bezier curve of hair, so cost of hair is not changed
+        :param results: results of benchmark
+        :param image_size: (width, height) of generated images, None uses the largest measured size
+        :return: None
+        """
+        sizes = {tuple(result["size"]) for result in results.values()}
+        if not sizes:
+            return
+        if image_size is None:
+            size = max(sizes, key=lambda size: size[0] * size[1])
+        else:
+            size = min(sizes, key=lambda size: abs(size[0] * size[1] - image_size[0] * image_size[1]))
+
+        times = {result["stage"]: result["p50_s"] for result in results.values()
+                 if tuple(result["size"]) == size and "p50_s" in result}
+        stage_costs = {
+            "image": ["save"],
+            "template": ["mask"],
+            "creases/level1": ["wrinkles_level_1"],
+            "creases/level2": ["wrinkles_level_2"],
+            "creases/level3": ["wrinkles_level_3"],
+            "scar": ["line_geometry", "thicken_line", "irregular_edges"],
+            "scar/outline": ["outline"],
+            "scar/patches": ["artifacts"],
+            "scar/distortion": ["soak_distortion"],
+        }
+        for key, stages in stage_costs.items():
+            if all(stage in times for stage in stages):
+                self.costs[key] = sum(times[stage] for stage in stages)
+
+    def calibrate_from_profile(self, images):
+        """
+
+        @brief: Learns costs from stage times of images saved by --profile. Time of damage is time of image without
+                loading, masking, encoding and writing, cost of hair is divided by amount of hair
+        :param images: records of images
+        :return: None
+        """
+        for image in images:
+            stages = image["stages"]
+            self.add_sample("image", sum(stages.get(stage, 0) for stage in OVERHEAD_STAGES))
+            if "mask" in stages:
+                self.add_sample("template", stages["mask"])
+            damage_time = image["total_s"] - sum(stages.get(stage, 0) for stage in OVERHEAD_STAGES + ["mask"])
+            if image.get("library"):
+                self.add_sample("library", damage_time)
+                continue
+            steps = image.get("steps") or []
+            self.add_sample("|".join(get_step_key(step) for step in steps), damage_time)
+            if len(steps) == 1:
+                step = steps[0]
+                if step["damage"] == "hair":
+                    damage_time /= max(step.get("hair_count", 1), 1)
+                self.add_sample(get_step_key(step), damage_time)
+
+    def get_cost(self, key):
+        """
+
+        @brief: Gets learned cost of configuration or its default cost
+        :param key: configuration key
+        :return: cost in seconds
+        """
+        learned = self.get_learned_cost(key)
+        if learned is not None:
+            return learned
+        return self.costs.get(key)
+
+    def estimate_step(self, step):
+        """
+
+        @brief: Estimates time of damage step
+        :param step: damage step as JSON serializable dictionary
+        :return: time in seconds
+        """
+        key = get_step_key(step)
+        if step["damage"] == "hair":
+            learned = self.get_learned_cost(key)
+            return (learned if learned is not None else self.costs["hair"]) * step.get("hair_count", 1)
+        learned = self.get_learned_cost(key)
+        if learned is not None:
+            return learned
+        if step["damage"] == "creases":
+            return self.costs[key]
+        cost = self.costs["scar"]
+        for flag in ("outline", "patches", "distortion"):
+            if step.get(flag):
+                cost += self.costs["scar/" + flag]
+        return cost
+
+    def estimate_task(self, task):
+        """
+
+        @brief: Estimates time of task without loading of template
+        :param task: task (see BatchRunner)
+        :return: configuration key of task and time in seconds
+        """
+        if task["library"] is not None:
+            key = "library/" + "+".join(step["damage"] for step in task["steps"])
+            return key, self.get_cost("image") + self.get_cost("library")
+        steps = DamageLibrary.describe_steps(task["steps"])
+        key = "|".join(get_step_key(step) for step in steps)
+        learned = self.get_learned_cost(key)
+        if learned is None:
+            learned = sum(self.estimate_step(step) for step in steps)
+        return key, self.get_cost("image") + learned
+
+    def estimate_wall_time(self, costs, workers, templates):
+        """
+
+        @brief: Estimates wall time of tasks generated by given amount of workers. Tasks can not be finished sooner than
+                the longest task, every worker has to start and load templates it uses
+        :param costs: estimated times of tasks
+        :param workers: amount of workers
+        :param templates: amount of distinct templates used by tasks
+        :return: time in seconds
+        """
+        if workers <= 1:
+            return sum(costs) + templates * self.get_cost("template")
+        templates_per_worker = min(templates, math.ceil(len(costs) / workers))
+        return max(sum(costs) / workers, max(costs)) + self.get_cost("worker_startup") + \
+            templates_per_worker * self.get_cost("template")
+
+    def plan(self, tasks, templates, max_workers):
+        """
+
+        @brief: Estimates time of tasks and recommends amount of workers - the smallest amount of workers whose
+                estimated time is within WORKER_TOLERANCE of the best time
+        :param tasks: list of tasks
+        :param templates: amount of distinct templates used by tasks
+        :param max_workers: maximal amount of workers
+        :return: plan as dictionary
+        """
+        configurations = {}
+        costs = []
+        for task in tasks:
+            key, cost = self.estimate_task(task)
+            configuration = configurations.setdefault(key, {"images": 0, "seconds": 0.0})
+            configuration["images"] += 1
+            configuration["seconds"] += cost
+            costs.append(cost)
+
+        wall_times = {}
+        if costs:
+            wall_times = {workers: self.estimate_wall_time(costs, workers, templates)
+                          for workers in range(1, max_workers + 1)}
+        recommended = 1
+        if wall_times:
+            best = min(wall_times.values())
+            recommended = min(workers for workers, seconds in wall_times.items()
+                              if seconds <= best * WORKER_TOLERANCE)
+        return {"images": len(tasks), "templates": templates, "configurations": configurations,
+                "serial_seconds": sum(costs), "wall_seconds": wall_times, "recommended_workers": recommended}
+
+    @staticmethod
+    def format_plan(plan):
+        """
+
+        @brief: Formats plan as text
+        :param plan: plan as dictionary
+        :return: formatted plan as string
+        """
+        lines = [f"Plan of {plan['images']} images from {plan['templates']} templates"]
+        for key, configuration in sorted(plan["configurations"].items(), key=lambda item: -item[1]["seconds"]):
+            lines.append(f"  {key:<50}{configuration['images']:>6} images  {configuration['seconds']:>9.2f} s  "
+                         f"({configuration['seconds'] / configuration['images']:.3f} s per image)")
+        lines.append(f"Estimated time with 1 worker: {plan['wall_seconds'].get(1, 0.0):.2f} s")
+        for workers, seconds in plan["wall_seconds"].items():
+            if workers > 1:
+                lines.append(f"  {workers} workers: {seconds:.2f} s")
+        lines.append(f"Recommended workers: {plan['recommended_workers']}")
+        return "\n".join(lines)
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Created By  : Vanessa Jóriová
+# Date        : 8.5.2022
+# Version     : 1.0
+
+import enum
+import json
+import os
+
+import cv2 as cv
+import numpy as np
+
+from Generator import Generator
+from Profiler import span
+
+# parameters of steps which are not compared when layer for requested damage is chosen, orientation is changed by
+# rotation of layer and amount of hair is given by layer itself
+IGNORED_STEP_PARAMETERS = ["damage", "orientation", "hair_count", "distortion"]
+
+# range of random scale applied to layer after it is scaled to size of fingerprint
+SCALE_RANGE = (0.9, 1.1)
+
+
+class DamageLibrary:
+    """
+    Library of pre-rendered damage layers stored in directory. Every layer is saved in its own compressed .npz file
+    containing:
+        :mask        boolean array, True for pixels covered by damage, cropped to bounding box of damage
+        :values      color of damage pixels
+        :meta        JSON string with damage steps, size of fingerprint in which layer was rendered and offset of
+                     layer center from center of this fingerprint
+    Layers are loaded lazily and kept in memory once loaded
+    """
+
+    def __init__(self, directory):
+        """
+
+        :param directory: path to directory with layers
+        """
+        self.directory = directory
+        self.entries = []
+        self.layers = {}
+        self.load_index()
+
+    def load_index(self):
+        """
+
+        @brief: Reads metadata of all layers in library directory
+        :return: None
+        """
+        for file in sorted(os.listdir(self.directory)):
+            if os.path.splitext(file)[1] != ".npz":
+                continue
+            with np.load(os.path.join(self.directory, file)) as data:
+                entry = json.loads(str(data["meta"]))
+            entry["file"] = file
+            self.entries.append(entry)
+        if len(self.entries) == 0:
+            print("There are no damage layers in library")
+            os._exit(-1)
+
+    @staticmethod
+    def describe_steps(steps):
+        """
+
+        @brief: Converts resolved damage steps to JSON serializable form, enum parameters are stored as lowercase names
+                (the same as values of command line arguments)
+        :param steps: resolved damage steps
+        :return: list of steps as dictionaries
+        """
+        described = []
+        for step in steps:
+            described.append({key: value.name.lower() if isinstance(value, enum.Enum) else value
+                              for key, value in step.items()})
+        return described
+
+    @staticmethod
+    def save_layer(directory, name, fingerprint, steps):
+        """
+
+        @brief: Saves damage recorded in fingerprint as layer of library. Only damage inside fingerprint area is saved,
+                existing layer is never overwritten
+        :param directory: path to library directory
+        :param name: name of layer file without extension
+        :param fingerprint: FingerprintImage instance with recorded damage
+        :param steps: resolved damage steps used to render damage
+        :return: True if layer was saved, False if no damage was recorded or layer with the same name already exists
+        """
+        mask = fingerprint.damage_mask & (fingerprint.fingerprint_mask > 0)
+        if not mask.any():
+            return False
+        x, y, width, height = cv.boundingRect(mask.astype(np.uint8))
+        center_x = fingerprint.fingerprint_x + fingerprint.fingerprint_width / 2
+        center_y = fingerprint.fingerprint_y + fingerprint.fingerprint_height / 2
+        meta = {
+            "damage": [step["damage"] for step in steps],
+            "steps": DamageLibrary.describe_steps(steps),
+            "fingerprint_size": max(fingerprint.fingerprint_width, fingerprint.fingerprint_height),
+            "offset": [x + width / 2 - center_x, y + height / 2 - center_y],
+        }
+        try:
+            with open(os.path.join(directory, name + ".npz"), "xb") as layer_file:
+                np.savez_compressed(layer_file, mask=mask[y:y + height, x:x + width],
+                                    values=fingerprint.damage_values[y:y + height, x:x + width], meta=json.dumps(meta))
+        except FileExistsError:
+            print(f"Damage layer {name} already exists in library, layer is not saved")
+            return False
+        return True
+
+    @staticmethod
+    def step_matches(requested, rendered):
+        """
+
+        @brief: Checks if rendered step satisfies requested step, parameters not specified in request match any value
+        :param requested: requested damage step as dictionary (unresolved, e.g. from recipe)
+        :param rendered: described step of layer
+        :return: True if step matches, False if not
+        """
+        if requested["damage"] != rendered["damage"]:
+            return False
+        for key, value in requested.items():
+            if key in IGNORED_STEP_PARAMETERS or not value:
+                continue
+            if rendered.get(key) != value:
+                return False
+        return True
+
+    def find_entries(self, steps):
+        """
+
+        @brief: Finds layers rendered with requested damage steps
+        :param steps: requested damage steps
+        :return: list of matching entries
+        """
+        matching = []
+        for entry in self.entries:
+            if len(entry["steps"]) != len(steps):
+                continue
+            if all(self.step_matches(requested, rendered) for requested, rendered in zip(steps, entry["steps"])):
+                matching.append(entry)
+        return matching
+
+    def get_layer(self, entry):
+        """
+
+        @brief: Gets mask and values of layer, layer is loaded from disk only once
+        :param entry: entry of library
+        :return: mask and values as arrays
+        """
+        if entry["file"] not in self.layers:
+            with np.load(os.path.join(self.directory, entry["file"])) as data:
+                self.layers[entry["file"]] = (data["mask"].astype(np.uint8), data["values"])
+        return self.layers[entry["file"]]
+
+    @staticmethod
+    def get_transformation(entry, layer_shape, fingerprint, rnd):
+        """
+
+        @brief: Creates random affine transformation of layer into fingerprint. Layer is randomly flipped, rotated and
+                scaled to size of fingerprint, its center is placed to the same relative position as in fingerprint
+                in which it was rendered and randomly translated within fingerprint bounding box
+        :param entry: entry of library
+        :param layer_shape: shape of layer
+        :param fingerprint: FingerprintImage instance with computed size
+        :param rnd: random generator (random module or random.Random instance)
+        :return: 2x3 transformation matrix
+        """
+        height, width = layer_shape
+        scale = max(fingerprint.fingerprint_width, fingerprint.fingerprint_height) / entry["fingerprint_size"]
+        scale *= rnd.uniform(*SCALE_RANGE)
+        matrix = cv.getRotationMatrix2D((width / 2, height / 2), rnd.uniform(0, 360), scale)
+        if rnd.randint(0, 1):
+            # horizontal flip around center of layer
+            matrix[:, 0] = -matrix[:, 0]
+            matrix[:, 2] += matrix[:, 0] * -width
+
+        offset = matrix[:, :2] @ np.array(entry["offset"])
+        center_x = fingerprint.fingerprint_x + fingerprint.fingerprint_width / 2
+        center_y = fingerprint.fingerprint_y + fingerprint.fingerprint_height / 2
+        shift_x = rnd.uniform(-fingerprint.fingerprint_width / 4, fingerprint.fingerprint_width / 4)
+        shift_y = rnd.uniform(-fingerprint.fingerprint_height / 4, fingerprint.fingerprint_height / 4)
+        matrix[0, 2] += center_x + offset[0] + shift_x - width / 2
+        matrix[1, 2] += center_y + offset[1] + shift_y - height / 2
+        return matrix
+
+    def apply_layer(self, fingerprint, entry, rng=None):
+        """
+
+        @brief: Draws randomly transformed layer into fingerprint, damage outside of fingerprint area is cropped
+        :param fingerprint: FingerprintImage instance with loaded image
+        :param entry: entry of library
+        :param rng: random generators of task (see create_random_generators), None uses global random generators
+        :return: generated image as array
+        """
+        generator = Generator(fingerprint, rng)
+        with span("load"):
+            mask, values = self.get_layer(entry)
+        with span("rasterize"):
+            matrix = self.get_transformation(entry, mask.shape, fingerprint, generator.rnd)
+            size = (fingerprint.img_width, fingerprint.img_height)
+            mask = cv.warpAffine(mask, matrix, size, flags=cv.INTER_NEAREST)
+            values = cv.warpAffine(values, matrix, size, flags=cv.INTER_NEAREST)
+
+        generator.add_damage_layer(mask > 0, values)
+        generator.composite_damage()
+        return generator.background
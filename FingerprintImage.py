@@ -20,18 +20,25 @@ class FingerprintImage:
         :param greyscale: image will be loaded as grayscale if true, else RGB image will be loaded
         """
         self.load_as_grayscale = greyscale
+        self.path = None
         self.img = None
         self.img_height = None
         self.img_width = None
         self.fingerprint_mask = None
+        self.fingerprint_pixels = None
         self.fingerprint_height = None
         self.fingerprint_width = None
+        self.fingerprint_x = None
+        self.fingerprint_y = None
+        self.damage_mask = None
+        self.damage_values = None
 
     def load_file_from_path(self, path):
         """
         @brief Loads image from given path
         :param path: path to file
         """
+        self.path = path
 
         if self.load_as_grayscale:
             self.img = cv.imread(path, cv.IMREAD_GRAYSCALE)
@@ -54,6 +61,31 @@ class FingerprintImage:
         self.img_width = int(self.img.shape[1])
         self.img_height = int(self.img.shape[0])
 
+    def copy(self):
+        """
+        @brief: Creates copy of fingerprint with its own copy of image. Mask, fingerprint pixels and fingerprint size
+                are shared with this instance
+        :return: FingerprintImage instance
+        """
+        fingerprint = FingerprintImage(self.load_as_grayscale)
+        fingerprint.path = self.path
+        fingerprint.set_img(self.img.copy())
+        fingerprint.fingerprint_mask = self.fingerprint_mask
+        fingerprint.fingerprint_pixels = self.fingerprint_pixels
+        fingerprint.fingerprint_height = self.fingerprint_height
+        fingerprint.fingerprint_width = self.fingerprint_width
+        fingerprint.fingerprint_x = self.fingerprint_x
+        fingerprint.fingerprint_y = self.fingerprint_y
+        return fingerprint
+
+    def start_damage_record(self):
+        """
+        @brief: Starts recording of all damage composited into this fingerprint by generators. Recorded damage is
+                stored in damage_mask (pixels covered by damage) and damage_values (color of damage)
+        """
+        self.damage_mask = np.zeros(self.img.shape[:2], bool)
+        self.damage_values = np.zeros(self.img.shape[:2], np.uint8)
+
     def create_mask(self):
         """
         @brief Creates fingerprint mask used for detecting the area of the fingerprint
@@ -70,6 +102,7 @@ class FingerprintImage:
             return
 
         self.fingerprint_mask = np.zeros(self.img.shape[:2], np.uint8)
+        self.fingerprint_pixels = None
 
         blur = cv.blur(self.img, (7, 7))
         ret, thresh = cv.threshold(blur, 240, 255, cv.THRESH_BINARY_INV)
@@ -91,6 +124,16 @@ class FingerprintImage:
         for c in range(0, len(contours)):
             cv.drawContours(self.fingerprint_mask, contours, c, 255, -1)
 
+    def get_fingerprint_pixels(self):
+        """
+
+        @brief: Gets [y,x] coordinates of all pixels inside fingerprint mask. Coordinates are computed once per mask
+                and cached
+        :return: array of [y,x] coordinates
+        """
+        if self.fingerprint_pixels is None:
+            self.fingerprint_pixels = np.argwhere(self.fingerprint_mask)
+        return self.fingerprint_pixels
 
     def get_fingerprint_size(self):
 
@@ -110,6 +153,8 @@ class FingerprintImage:
 
         self.fingerprint_height = height
         self.fingerprint_width = width
+        self.fingerprint_x = x
+        self.fingerprint_y = y
 
     def show_image(self):
         """
@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Created By  : Vanessa Jóriová
+# Date        : 8.5.2022
+# Version     : 1.0
+
+import argparse
+import base64
+import io
+import json
+import os
+import queue
+import signal
+import socketserver
+import stat
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2 as cv
+import numpy as np
+
+from BatchRunner import OUTPUT_FORMATS
+from DamageLibrary import DamageLibrary
+
+# arguments which can be given in request, other arguments are given when server is started
+REQUEST_ARGUMENTS = ["creases", "level", "hair", "type", "hair_count", "scar", "length", "width", "orientation",
+                     "outline", "patches", "distortion", "recipe", "max_attempts", "time_budget", "seed", "amount",
+                     "variants_per_image", "image"]
+
+# time in seconds for which requests are collected into one batch
+BATCH_WINDOW = 0.01
+
+# default amount of requests accepted at once, following requests are refused until some request is finished
+DEFAULT_MAX_REQUESTS = 8
+
+# default host of server if only port is given
+DEFAULT_HOST = "127.0.0.1"
+
+
+class RequestError(Exception):
+    """
+
+    Exception raised when request can not be processed, contains HTTP status of response
+    """
+
+    def __init__(self, message, status=400):
+        """
+
+        :param message: description of error
+        :param status: HTTP status code
+        """
+        super().__init__(message)
+        self.status = status
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    HTTP server listening on Unix socket, every request is handled in its own thread
+    """
+    daemon_threads = True
+
+
+class GenerationRequestHandler(BaseHTTPRequestHandler):
+    """
+    Handler of HTTP requests of generation server:
+        GET /health       state of server as JSON
+        POST /generate    generates images of damage specification given as JSON object
+    """
+    generation_server = None
+
+    def address_string(self):
+        # client of Unix socket has no address
+        return self.client_address[0] if self.client_address else "local"
+
+    def send_body(self, status, content_type, body):
+        """
+
+        @brief: Sends response
+        :param status: HTTP status code
+        :param content_type: content type of body
+        :param body: body as bytes
+        :return: None
+        """
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, status, data):
+        """
+
+        @brief: Sends JSON response
+        :param status: HTTP status code
+        :param data: JSON serializable data
+        :return: None
+        """
+        self.send_body(status, "application/json", json.dumps(data).encode())
+
+    def do_GET(self):
+        if self.path != "/health":
+            self.send_json(404, {"error": f"Unknown path: {self.path}"})
+            return
+        self.send_json(200, self.generation_server.get_health())
+
+    def do_POST(self):
+        if self.path != "/generate":
+            self.send_json(404, {"error": f"Unknown path: {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            spec = json.loads(self.rfile.read(length))
+        except ValueError as exc:
+            self.send_json(400, {"error": f"Request is not valid JSON: {exc}"})
+            return
+        try:
+            content_type, body = self.generation_server.generate(spec)
+        except RequestError as exc:
+            self.send_json(exc.status, {"error": str(exc)})
+        except Exception as exc:
+            self.send_json(500, {"error": f"Request could not be processed: {exc!r}"})
+        else:
+            self.send_body(200, content_type, body)
+
+
+class GenerationServer:
+    """
+    Local server generating damaged fingerprints on demand. Corpus index, templates with their masks and pool of workers
+    are loaded once when server starts and kept warm for all requests. Request is JSON object with the same arguments
+    as job manifest (REQUEST_ARGUMENTS, e.g. {"recipe": "creases,hair", "level": 2, "amount": 4, "seed": 7}), arguments
+    given when server is started are used as defaults. Recipe can be also given directly as list of steps. Request can
+    also contain:
+        :format         jpeg (default) or png returns JSON with base64 encoded images, raw returns .npz file with arrays
+        :damage_mask    True returns also mask of pixels covered by damage
+    Requests arriving within BATCH_WINDOW are generated together as one batch, amount of requests accepted at once is
+    limited, server answers 503 when limit is reached
+    """
+
+    def __init__(self, arg_parser, max_requests=DEFAULT_MAX_REQUESTS):
+        """
+
+        :param arg_parser: ArgParser instance with configured arguments and BatchRunner
+        :param max_requests: amount of requests accepted at once
+        """
+        self.arg_parser = arg_parser
+        self.base_args = arg_parser.args
+        self.image = arg_parser.image
+        self.directory = arg_parser.directory
+        self.max_requests = max_requests
+        self.slots = threading.BoundedSemaphore(max_requests)
+        self.requests = queue.Queue()
+        self.batch_thread = None
+        self.parser_lock = threading.Lock()
+
+    def get_corpus(self):
+        """
+
+        @brief: Gets paths of all templates which can be requested
+        :return: list of paths
+        """
+        if self.directory is not None:
+            return self.arg_parser.runner.get_corpus(self.directory)
+        return [self.image]
+
+    def get_health(self):
+        """
+
+        @brief: Gets state of server
+        :return: state as dictionary
+        """
+        runner = self.arg_parser.runner
+        status = "ok" if self.batch_thread is not None and self.batch_thread.is_alive() else "error"
+        return {"status": status, "workers": runner.workers, "backend": runner.backend,
+                "templates": len(self.get_corpus()), "max_requests": self.max_requests,
+                "queued": self.requests.qsize()}
+
+    def generate(self, spec):
+        """
+
+        @brief: Generates images of request, called by handler thread. Request is added to queue and processed in next
+                batch
+        :param spec: damage specification as dictionary
+        :return: content type and body of response
+        """
+        if not self.slots.acquire(blocking=False):
+            raise RequestError("Server is busy, try again later", 503)
+        try:
+            request = {"spec": spec, "event": threading.Event(), "tasks": [], "results": [], "error": None}
+            self.requests.put(request)
+            request["event"].wait()
+            if request["error"] is not None:
+                raise request["error"]
+            return self.create_response(request)
+        finally:
+            self.slots.release()
+
+    def process_batches(self):
+        """
+
+        @brief: Collects requests into batches and generates them, runs in its own thread. Unexpected error of batch is
+                returned to all its unfinished requests, so thread keeps processing following batches
+        :return: None
+        """
+        while True:
+            requests = [self.requests.get()]
+            deadline = time.perf_counter() + BATCH_WINDOW
+            while len(requests) < self.max_requests:
+                try:
+                    requests.append(self.requests.get(timeout=max(deadline - time.perf_counter(), 0)))
+                except queue.Empty:
+                    break
+            try:
+                self.process_batch(requests)
+            except Exception as exc:
+                for request in requests:
+                    if not request["event"].is_set():
+                        request["error"] = request["error"] or RequestError(f"Generation failed: {exc!r}", 500)
+                        request["event"].set()
+
+    def process_batch(self, requests):
+        """
+
+        @brief: Generates tasks of all requests in one run of BatchRunner. Invalid requests get error 400, request
+                whose task failed gets error 500, other requests of batch are returned normally. If whole run fails,
+                all unfinished requests get error 500
+        :param requests: list of requests
+        :return: None
+        """
+        tasks = []
+        for index, request in enumerate(requests):
+            try:
+                request["tasks"] = self.create_tasks(request["spec"], index)
+                tasks.extend(request["tasks"])
+            except RequestError as exc:
+                request["error"] = exc
+            except Exception as exc:
+                request["error"] = RequestError(f"Request could not be processed: {exc!r}", 500)
+                request["tasks"] = []
+        try:
+            if tasks:
+                for result in self.arg_parser.runner.run(tasks, self.arg_parser.get_cost_model(tasks)):
+                    request = requests[result["job"]]
+                    if result["error"] is not None:
+                        request["error"] = request["error"] or RequestError(f"Generation failed: {result['error']}",
+                                                                            500)
+                    request["results"].append(result)
+        except Exception as exc:
+            for request in requests:
+                if len(request["results"]) < len(request["tasks"]):
+                    request["error"] = request["error"] or RequestError(f"Generation failed: {exc!r}", 500)
+        finally:
+            for request in requests:
+                request["event"].set()
+
+    def validate_request(self, spec):
+        """
+
+        @brief: Checks arguments of request
+        :param spec: damage specification
+        :return: None, raises RequestError if request is not valid
+        """
+        if not isinstance(spec, dict):
+            raise RequestError("Request must be JSON object.")
+        actions = {action.dest: action for action in self.arg_parser.parser._actions}
+        for key, value in spec.items():
+            if key == "format":
+                if value not in OUTPUT_FORMATS:
+                    raise RequestError(f"Format must be one of {', '.join(OUTPUT_FORMATS)}.")
+            elif key == "damage_mask":
+                if not isinstance(value, bool):
+                    raise RequestError("damage_mask must be true or false.")
+            elif key not in REQUEST_ARGUMENTS:
+                raise RequestError(f"Unknown argument in request: {key}")
+            elif actions[key].choices is not None and value not in actions[key].choices:
+                raise RequestError(f"Invalid value of {key} in request: {value}")
+            elif actions[key].const is True and not isinstance(value, bool):
+                raise RequestError(f"{key} must be true or false.")
+
+        for key in ("amount", "variants_per_image", "max_attempts", "seed"):
+            if key in spec and (not isinstance(spec[key], int) or isinstance(spec[key], bool)):
+                raise RequestError(f"{key} must be integer.")
+        if spec.get("amount", 1) < 1 or spec.get("variants_per_image", 1) < 1 or spec.get("max_attempts", 1) < 1:
+            raise RequestError("amount, variants_per_image and max_attempts must be positive numbers.")
+        if "time_budget" in spec and (not isinstance(spec["time_budget"], (int, float)) or
+                                      isinstance(spec["time_budget"], bool) or spec["time_budget"] <= 0):
+            raise RequestError("time_budget must be positive number.")
+        if "image" in spec and spec["image"] not in self.get_template_names():
+            raise RequestError(f"Unknown template: {spec['image']}")
+
+        recipe = spec.get("recipe")
+        if isinstance(recipe, str):
+            if any(damage not in ("creases", "scar", "hair") for damage in recipe.split(",")):
+                raise RequestError("Recipe must be list of steps or comma separated damage types.")
+        elif recipe is not None:
+            if not isinstance(recipe, list) or not all(isinstance(step, dict) for step in recipe):
+                raise RequestError("Recipe must be list of steps or comma separated damage types.")
+
+    def get_template_names(self):
+        """
+
+        @brief: Gets templates which can be requested by file name or by path
+        :return: dictionary name or path -> path
+        """
+        names = {}
+        for path in self.get_corpus():
+            names[path] = path
+            names[os.path.basename(path)] = path
+        return names
+
+    def create_tasks(self, spec, job):
+        """
+
+        @brief: Creates tasks of request in the same way as tasks of command line, so request with seed generates the
+                same images as command line with the same arguments
+        :param spec: damage specification
+        :param job: index of request in batch
+        :return: list of tasks
+        """
+        self.validate_request(spec)
+        with self.parser_lock:
+            return self.create_parser_tasks(spec, job)
+
+    def create_parser_tasks(self, spec, job):
+        """
+
+        @brief: Creates tasks of request by shared ArgParser, arguments of request are set to parser only for time of
+                creating tasks, so parser keeps arguments given when server was started. Must be called with parser
+                lock held
+        :param spec: validated damage specification
+        :param job: index of request in batch
+        :return: list of tasks
+        """
+        parser = self.arg_parser
+        saved = parser.args, parser.image, parser.amount, parser.variants
+        parser.args = argparse.Namespace(**{**vars(self.base_args),
+                                            **{key: value for key, value in spec.items() if key in REQUEST_ARGUMENTS}})
+        try:
+            if isinstance(parser.args.recipe, str):
+                parser.args.recipe = [parser.get_step_from_args(damage) for damage in parser.args.recipe.split(",")]
+            recipes = parser.get_recipes()
+            if not recipes:
+                raise RequestError("Request does not contain any damage.")
+            for steps in recipes:
+                error = parser.get_recipe_error(steps)
+                if error is not None:
+                    raise RequestError(error)
+                if parser.args.library and not parser.runner.get_library(parser.args.library).find_entries(steps):
+                    raise RequestError("Damage library does not contain requested damage.")
+
+            parser.image = self.get_template_names()[spec["image"]] if "image" in spec else self.image
+            parser.amount = spec.get("amount", 1)
+            parser.variants = spec.get("variants_per_image", 1)
+            tasks = parser.create_tasks()
+        finally:
+            parser.args, parser.image, parser.amount, parser.variants = saved
+
+        for number, task in enumerate(tasks, 1):
+            task.update({"number": number, "job": job, "output": spec.get("format", "jpeg"),
+                         "damage_mask": spec.get("damage_mask", False)})
+        return tasks
+
+    @staticmethod
+    def create_response(request):
+        """
+
+        @brief: Creates response of finished request. Images encoded as JPEG or PNG are returned in JSON together with
+                their parameters, damage masks are encoded as PNG. Raw images are returned in .npz file with arrays
+                image_<number> and damage_mask_<number> and parameters of images in meta JSON string
+        :param request: finished request
+        :return: content type and body of response
+        """
+        results = {result["number"]: result for result in request["results"]}
+        images = []
+        arrays = {}
+        for task in request["tasks"]:
+            result = results[task["number"]]
+            image = {"number": task["number"], "seed": task["seed"], "damage": result["damage"],
+                     "steps": DamageLibrary.describe_steps(task["steps"])}
+            output = result["output"]
+            if output is None:
+                image["skipped"] = True
+            elif task["output"] == "raw":
+                image["template"] = output["template"]
+                arrays[f"image_{task['number']}"] = output["image"]
+                if output["damage_mask"] is not None:
+                    arrays[f"damage_mask_{task['number']}"] = output["damage_mask"]
+            else:
+                image["template"] = output["template"]
+                image["image"] = base64.b64encode(output["image"]).decode()
+                if output["damage_mask"] is not None:
+                    mask = cv.imencode(".png", output["damage_mask"].astype(np.uint8) * 255)[1]
+                    image["damage_mask"] = base64.b64encode(mask.tobytes()).decode()
+            images.append(image)
+
+        if request["tasks"] and request["tasks"][0]["output"] == "raw":
+            body = io.BytesIO()
+            np.savez(body, meta=json.dumps(images), **arrays)
+            return "application/octet-stream", body.getvalue()
+        return "application/json", json.dumps({"images": images}).encode()
+
+    def serve(self, address):
+        """
+
+        @brief: Loads templates, starts workers and serves requests until interrupted (Ctrl+C or SIGTERM)
+        :param address: port, host:port or path to Unix socket
+        :return: None
+        """
+        unix_socket = not address.isdigit() and ":" not in address
+        if unix_socket and os.path.lexists(address):
+            # only stale socket of previous server is removed, other files are never deleted
+            if not stat.S_ISSOCK(os.lstat(address).st_mode):
+                print(f"Path of Unix socket already exists and is not socket: {address}")
+                os._exit(-1)
+            os.remove(address)
+        self.arg_parser.runner.warm_up(self.get_corpus())
+        if not unix_socket:
+            host, _, port = address.rpartition(":")
+            http_server = ThreadingHTTPServer((host or DEFAULT_HOST, int(port)), GenerationRequestHandler)
+            print(f"Serving on http://{host or DEFAULT_HOST}:{port}")
+        else:
+            http_server = UnixHTTPServer(address, GenerationRequestHandler)
+            print(f"Serving on unix socket {address}")
+        GenerationRequestHandler.generation_server = self
+        self.batch_thread = threading.Thread(target=self.process_batches, daemon=True)
+        self.batch_thread.start()
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        try:
+            http_server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            http_server.server_close()
+            if unix_socket and os.path.lexists(address):
+                os.remove(address)
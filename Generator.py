@@ -5,9 +5,47 @@
 # Date        : 8.5.2022
 # Version     : 1.0
 
+import random
+import time
+
 import cv2 as cv
 import numpy as np
 from FingerprintImage import FingerprintImage
+from Profiler import span
+import Metrics
+
+# default budget of every sampling stage (attempts and seconds)
+DEFAULT_MAX_ATTEMPTS = 1000
+DEFAULT_TIME_BUDGET = 10.0
+
+
+class GenerationBudgetExceeded(Exception):
+    """
+
+    Exception raised when sampling stage of generator runs out of its attempt or time budget
+    """
+
+    def __init__(self, stage, attempt_counters):
+        """
+
+        :param stage: name of sampling stage which exceeded budget
+        :param attempt_counters: attempt counters of all sampling stages of generator
+        """
+        super().__init__(f"Sampling stage '{stage}' exceeded its budget")
+        self.stage = stage
+        self.attempt_counters = dict(attempt_counters)
+
+
+def create_random_generators(seed):
+    """
+
+    @brief: Creates random generators of one task, generators of different tasks are independent, so tasks can be
+            generated concurrently in threads. Generators produce the same values as global random generators seeded by
+            the same seed
+    :param seed: seed of random generators
+    :return: random.Random and numpy.random.RandomState instances
+    """
+    return random.Random(seed), np.random.RandomState(seed)
 
 
 class Generator:
@@ -16,13 +54,19 @@ class Generator:
     Class capable of drawing synthetic damage from damage_canvas into fingerprint area
     """
 
-    def __init__(self, fingerprint: FingerprintImage):
+    def __init__(self, fingerprint: FingerprintImage, rng=None):
         """
 
         :param fingerprint: Instance of FingerprintImage class with loaded image
+        :param rng: random.Random and numpy.random.RandomState instances used by generator (see
+                    create_random_generators), None uses global random generators
         """
-        fingerprint.create_mask()
-        fingerprint.get_fingerprint_size()
+        self.rnd, self.np_random = rng if rng is not None else (random, np.random)
+        # mask and size are computed once per fingerprint and reused by all generators working with it
+        if fingerprint.fingerprint_mask is None:
+            fingerprint.create_mask()
+        if fingerprint.fingerprint_width is None:
+            fingerprint.get_fingerprint_size()
         self.fingerprint = fingerprint
         self.background = fingerprint.img
         self.background_mask = fingerprint.fingerprint_mask
@@ -33,10 +77,55 @@ class Generator:
         self.fingerprint_height = fingerprint.fingerprint_height
         self.damage_canvas = self.create_damage_canvas()
 
+        # all damage is accumulated in damage layer and drawn into fingerprint once by composite_damage
+        self.damage_layer = self.create_damage_canvas()
+        self.damage_layer_mask = np.zeros(self.background.shape[:2], bool)
+
         self.damage_pixels = None
         self.background_pixels = None
         self.fingerprint_pixels = None
 
+        self.max_attempts = DEFAULT_MAX_ATTEMPTS
+        self.time_budget = DEFAULT_TIME_BUDGET
+        self.attempt_counters = {}
+
+    def set_budget(self, max_attempts=None, time_budget=None):
+        """
+
+        @brief: Sets attempt and time budget of every sampling stage, None keeps current value
+        :param max_attempts: maximum number of attempts of sampling stage
+        :param time_budget: maximum time of sampling stage in seconds
+        :return: None
+        """
+        if max_attempts is not None:
+            self.max_attempts = max_attempts
+        if time_budget is not None:
+            self.time_budget = time_budget
+
+    def count_attempt(self, stage):
+        """
+
+        @brief: Increments attempt counter of given sampling stage
+        :param stage: name of sampling stage
+        :return: None
+        """
+        self.attempt_counters[stage] = self.attempt_counters.get(stage, 0) + 1
+        Metrics.count(stage + "_attempts")
+
+    def within_budget(self, attempt, stage_start):
+        """
+
+        @brief: Checks if sampling stage can make another attempt
+        :param attempt: number of attempts already made by stage
+        :param stage_start: time of stage start as returned by time.perf_counter()
+        :return: True if stage is within attempt and time budget, False if not
+        """
+        if attempt >= self.max_attempts:
+            return False
+        if time.perf_counter() - stage_start > self.time_budget:
+            return False
+        return True
+
     def create_damage_canvas(self):
         """
 
@@ -59,22 +148,95 @@ class Generator:
         @brief: Detects and returns any white (damage) pixels drawn on black canvas
         :return: [x,y] coordinates of white points on canvas
         """
-        non_zero = np.nonzero(self.damage_canvas)
-        coordinates = list(zip(non_zero[0], non_zero[1]))
-        coordinates = np.array(coordinates)
-        points = coordinates.reshape(-1, 2)
-        self.damage_pixels = points
-        return points
+        self.damage_pixels = np.argwhere(self.damage_canvas)
+        return self.damage_pixels
+
+    @staticmethod
+    def draw_disks(image, points, radius, color):
+        """
+
+        @brief: Draws filled circle (same shape as cv.circle) on every given point in one pass. Circle centers are
+                rasterized into area around points, which is dilated by circle shaped kernel
+        :param image: Image in which circles are drawn
+        :param points: Array of (x,y) coordinates, circles lying partially outside of image are drawn partially
+        :param radius: Radius of circles
+        :param color: Color of circles
+        :return: None
+        """
+        points = np.asarray(points, dtype=int).reshape(-1, 2)
+        height, width = image.shape[:2]
+        Metrics.count("disk_draw_calls")
+        Metrics.count("disks_drawn", len(points))
+
+        # only centers of circles that can reach into image are rasterized
+        inside = (points[:, 0] >= -radius) & (points[:, 0] < width + radius) & \
+                 (points[:, 1] >= -radius) & (points[:, 1] < height + radius)
+        points = points[inside]
+        if len(points) == 0:
+            return
+
+        x_min = points[:, 0].min() - radius
+        y_min = points[:, 1].min() - radius
+        x_max = points[:, 0].max() + radius
+        y_max = points[:, 1].max() + radius
+        centers = np.zeros((y_max - y_min + 1, x_max - x_min + 1), np.uint8)
+        centers[points[:, 1] - y_min, points[:, 0] - x_min] = 255
+
+        kernel = np.zeros((2 * radius + 1, 2 * radius + 1), np.uint8)
+        cv.circle(kernel, (radius, radius), radius, 1, -1)
+        circles = cv.dilate(centers, kernel)
+
+        # copy part of area lying inside image
+        x_start = max(x_min, 0)
+        y_start = max(y_min, 0)
+        x_end = min(x_max, width - 1)
+        y_end = min(y_max, height - 1)
+        circles = circles[y_start - y_min:y_end - y_min + 1, x_start - x_min:x_end - x_min + 1]
+        image[y_start:y_end + 1, x_start:x_end + 1][circles > 0] = color
+
+    def add_damage_layer(self, mask, value):
+        """
+
+        @brief: Merges new damage into damage layer, new damage is drawn over already accumulated damage
+        :param mask: boolean array of image size, True for pixels covered by damage
+        :param value: color of damage as integer or array of image size
+        :return: None
+        """
+        if np.isscalar(value):
+            self.damage_layer[mask] = value
+        else:
+            self.damage_layer[mask] = value[mask]
+        self.damage_layer_mask |= mask
+
+    def composite_damage(self, threshold=None):
+        """
+
+        @brief: Draws accumulated damage layer into background, crops it by fingerprint mask and optionally applies
+                threshold. Damage layer is cleared afterwards. If fingerprint records damage, layer is recorded too
+        :param threshold: threshold value, if None, threshold is not applied
+        :return: None
+        """
+        with span("composite"):
+            self.background[self.damage_layer_mask] = self.damage_layer[self.damage_layer_mask]
+            if self.fingerprint.damage_mask is not None:
+                self.fingerprint.damage_mask |= self.damage_layer_mask
+                self.fingerprint.damage_values[self.damage_layer_mask] = self.damage_layer[self.damage_layer_mask]
+            self.damage_layer[:] = 0
+            self.damage_layer_mask[:] = False
+            self.crop_by_mask()
+        if threshold is not None:
+            with span("threshold"):
+                ret, thresh = cv.threshold(self.background, threshold, 255, cv.THRESH_BINARY)
+            self.background = thresh
 
     def draw_on_background(self):
         """
 
-        @brief:  Copies all white pixels from damage_canvas into background image, thus redrawing
-        the damage
+        @brief:  Adds all white pixels from damage_canvas into damage layer, damage is drawn into background by
+        composite_damage
         """
-        pixels = self.get_damage_pixels()
-        for p in pixels:
-            self.background[p[0], p[1]] = self.damage_canvas[p[0], p[1]]
+        self.get_damage_pixels()
+        self.add_damage_layer(self.damage_canvas > 0, self.damage_canvas)
 
     def find_fingerprint_pixels(self):
         """
@@ -82,13 +244,7 @@ class Generator:
         @brief: Gets [x,y] coordinates of all pixels belonging to the fingerprint area based on color of the same pixel
         in the mask (pixels inside fingerprint are white, outside black)
         """
-        white_pixels = np.nonzero(self.background_mask)
-
-        coordinates = list(zip(white_pixels[0], white_pixels[1]))
-        coordinates = np.array(coordinates)
-        points = coordinates.reshape(-1, 2)
-
-        self.fingerprint_pixels = points
+        self.fingerprint_pixels = self.fingerprint.get_fingerprint_pixels()
 
     def get_bigger_side_size(self):
         """
@@ -119,11 +275,7 @@ class Generator:
         @brief: Gets [x,y] coordinates of all pixels belonging to the background area based on color of the same pixel
         in the mask (pixels inside fingerprint are white, outside black)
         """
-        black_pixels = np.where(self.background_mask == 0)
-        coordinates = list(zip(black_pixels[0], black_pixels[1]))
-        coordinates = np.array(coordinates)
-        points = coordinates.reshape(-1, 2)
-        self.background_pixels = points
+        self.background_pixels = np.argwhere(self.background_mask == 0)
 
     def split_fingerprint_and_background_pixels(self):
         """
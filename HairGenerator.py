@@ -6,14 +6,23 @@
 # Version     : 1.0
 
 import math
+import time
 
 import numpy as np
 import enum
-import random as rnd
 import cv2 as cv
 
 from FingerprintImage import FingerprintImage
-from Generator import Generator
+from Generator import Generator, GenerationBudgetExceeded
+from Profiler import span
+
+
+# amount of point pairs sampled at once when looking for short hair
+POINT_PAIRS_BATCH = 64
+
+# amount of points of curve at which crease irregularities and opacity damage are sampled, independent of amount of
+# points of curve, so density of these details does not depend on length of hair
+DETAIL_POINTS = 1001
 
 
 class HairLength(enum.Enum):
@@ -26,14 +35,11 @@ def check_line_length(distance_between_points, bigger_side_size):
     """
 
     @brief: Checks if hair is long enough
-    :param distance_between_points: Distance between start and end point
+    :param distance_between_points: Distance between start and end point (or array of distances)
     :param bigger_side_size: Bigger side of image as scale
-    :return: None
+    :return: True if hair is long enough, for array of distances boolean array
     """
-    if distance_between_points > bigger_side_size / 4:
-        return True
-    else:
-        return False
+    return distance_between_points > bigger_side_size / 4
 
 
 class HairGenerator(Generator):
@@ -43,13 +49,15 @@ class HairGenerator(Generator):
     Attributes:
         :length_type     SHORT or LONG
         :points          array of points of curve in (x,y) coordinate format
+        :hair_layer      canvas with all hair drawn with their opacity (black means no hair)
         :fingerprint     instance of Fingerprint class with
     """
 
-    def __init__(self, fingerprint: FingerprintImage):
-        super().__init__(fingerprint)
+    def __init__(self, fingerprint: FingerprintImage, rng=None):
+        super().__init__(fingerprint, rng)
         self.length_type = None
         self.points = None
+        self.hair_layer = None
 
     def set_length_type(self, length_type):
         """
@@ -59,44 +67,76 @@ class HairGenerator(Generator):
         :return:
         """
         if length_type == HairLength.RANDOM:
-            self.length_type = rnd.choice((HairLength.SHORT, HairLength.LONG))
+            self.length_type = self.rnd.choice((HairLength.SHORT, HairLength.LONG))
         else:
             self.length_type = length_type
 
-    def generate_hair(self, length_type=HairLength.RANDOM):
+    def generate_hair(self, length_type=HairLength.RANDOM, amount=1):
         """
 
-        @brief: Generate hair of given type
-        :param length_type:
+        @brief: Generate given amount of hair of given type. Creases of all hair are drawn into one damage canvas and
+                all hair into one hair layer, both are composited into fingerprint once at the end
+        :param length_type: HairLength enum, in case of RANDOM type is selected for every hair
+        :param amount: amount of hair
         :return:
         """
-        self.set_length_type(length_type)
+        self.damage_canvas = self.create_damage_canvas()
+        self.hair_layer = self.create_damage_canvas()
+        for i in range(0, amount):
+            self.set_length_type(length_type)
+            with span("sample_geometry"):
+                self.sample_hair()
+            with span("rasterize"):
+                self.draw_hair()
+                self.hair_opacity_damage()
+
+        with span("composite"):
+            self.draw_on_background()
+            self.add_damage_layer(self.hair_layer > 0, self.hair_layer)
+        self.composite_damage()
+
+    def sample_hair(self):
+        """
+
+        @brief: Generates points of hair until hair crossing fingerprint area is found. If long hair can not be found
+                within attempt and time budget, short hair is generated instead. If even short hair can not be found,
+                GenerationBudgetExceeded is raised
+        :return: None
+        """
         while True:
-            start_point, end_point, control_point = self.get_start_end_and_control_point()
-
-            self.quadratic_bezier(start_point, end_point, control_point)
-            if self.length_type is HairLength.LONG:
-                point = self.points[len(self.points) - 1]
-                if (self.background_mask[point[1], point[0]] == 0) and (
-                        self.all_points_outside_fingerprint_area() is False):
-                    break;
-            else:
-                if self.all_points_outside_fingerprint_area() is False:
-                    break
-        self.draw_hair()
-        self.hair_opacity_damage()
+            stage_start = time.perf_counter()
+            attempt = 0
+            while self.within_budget(attempt, stage_start):
+                attempt += 1
+                self.count_attempt("hair")
+                start_point, end_point, control_point = self.get_start_end_and_control_point()
+
+                self.quadratic_bezier(start_point, end_point, control_point)
+                if self.length_type is HairLength.LONG:
+                    point = self.points[len(self.points) - 1]
+                    if (self.background_mask[point[1], point[0]] == 0) and (
+                            self.all_points_outside_fingerprint_area() is False):
+                        return
+                else:
+                    if self.all_points_outside_fingerprint_area() is False:
+                        return
+
+            if self.length_type is HairLength.SHORT:
+                raise GenerationBudgetExceeded("hair", self.attempt_counters)
+            self.length_type = HairLength.SHORT
+            self.count_attempt("relax_length")
 
     def draw_hair(self):
         """
 
-        @brief: Draw hair damage (hair and crease around hair)
+        @brief: Draw hair damage (crease around hair into damage canvas and hair into hair layer)
         :return: None
         """
 
         bigger_side_size = self.get_bigger_fingerprint_side_size()
 
         width = int(bigger_side_size / 150)
-        variance = rnd.randrange(0, width)
+        variance = self.rnd.randrange(0, width)
         width += variance
         if width < 3:
             width = 3
@@ -104,13 +144,10 @@ class HairGenerator(Generator):
         # draw crease around hair
         cv.polylines(self.damage_canvas, [self.points], False, 255, int(width))
         self.crease_irregularities(width)
-        self.draw_on_background()
-        self.crop_by_mask()
 
         # draw hair
-        hair_opacity = rnd.randrange(180, 210)
-        cv.polylines(self.background, [self.points], False, hair_opacity, 1)
-        self.crop_by_mask()
+        hair_opacity = self.rnd.randrange(180, 210)
+        cv.polylines(self.hair_layer, [self.points], False, hair_opacity, 1)
 
     def hair_opacity_damage(self):
         """
@@ -118,11 +155,21 @@ class HairGenerator(Generator):
         @brief: Draws small white circles over some parts of hair to lower it's opacity
         :return: None
         """
-        opacity_damage_level = rnd.randrange(1, 6)
-        for p in self.points:
-            x = rnd.randrange(0, 15)
-            if x < opacity_damage_level:
-                cv.circle(self.background, p, 1, (255, 0, 255), -1)
+        opacity_damage_level = self.rnd.randrange(1, 6)
+        points = self.get_detail_points()
+        damaged = self.np_random.randint(0, 15, size=len(points)) < opacity_damage_level
+        # circles erase hair from hair layer and are drawn white over fingerprint
+        self.draw_disks(self.hair_layer, points[damaged], 1, 0)
+        self.draw_disks(self.damage_canvas, points[damaged], 1, 255)
+
+    def get_detail_points(self):
+        """
+
+        @brief: Gets DETAIL_POINTS points evenly distributed along bezier curve, at which details of hair are sampled
+        :return: array of points in (x,y) coordinate format
+        """
+        indices = np.rint(np.linspace(0, len(self.points) - 1, DETAIL_POINTS)).astype(int)
+        return self.points[indices]
 
     def get_start_end_and_control_point(self):
         """
@@ -131,21 +178,20 @@ class HairGenerator(Generator):
         :return: start, end and control point of bezier curve as (x, y) coordinates
         """
 
-        self.split_fingerprint_and_background_pixels()
         bigger_side_size = self.get_bigger_side_size()
 
         if self.length_type == HairLength.LONG:
-            side = rnd.choice(('X', 'Y'))
+            side = self.rnd.choice(('X', 'Y'))
             if side == 'X':
                 start_x = 0
                 end_x = self.background_width
-                start_y = rnd.randrange(0, self.background_height)
-                end_y = rnd.randrange(0, self.background_height)
+                start_y = self.rnd.randrange(0, self.background_height)
+                end_y = self.rnd.randrange(0, self.background_height)
             elif side == 'Y':
                 start_y = 0
                 end_y = self.background_height
-                start_x = rnd.randrange(0, self.background_width)
-                end_x = rnd.randrange(0, self.background_width)
+                start_x = self.rnd.randrange(0, self.background_width)
+                end_x = self.rnd.randrange(0, self.background_width)
 
             start_point = (start_x, start_y)
             end_point = (end_x, end_y)
@@ -153,102 +199,65 @@ class HairGenerator(Generator):
         elif self.length_type == HairLength.SHORT:
             start_point, end_point = self.get_two_points_inside_fingerprint(bigger_side_size)
 
-        control_x = rnd.randrange(0, self.fingerprint.img_width)
-        control_y = rnd.randrange(0, self.fingerprint.img_height)
+        control_x = self.rnd.randrange(0, self.fingerprint.img_width)
+        control_y = self.rnd.randrange(0, self.fingerprint.img_height)
         control_point = (control_x, control_y)
         return start_point, end_point, control_point
 
     def get_two_points_inside_fingerprint(self, bigger_side_size):
         """
 
-        @brief: Randomly generates two points in fingerprint area
+        @brief: Randomly generates two points in fingerprint area, that are far enough from each other. Pairs of points
+                are sampled in batches from cached fingerprint pixels
         :param bigger_side_size: Bigger side of image
         :return: start and end point as (x, y) coordinates
         """
-        while True:
-            index_1 = np.random.choice(self.fingerprint_pixels.shape[0], 1, replace=False)
-            index_2 = np.random.choice(self.fingerprint_pixels.shape[0], 1, replace=False)
-            start_point = self.fingerprint_pixels[index_1][0]
-            end_point = self.fingerprint_pixels[index_2][0]
-            start_point = (start_point[1], start_point[0])
-            end_point = (end_point[1], end_point[0])
-            distance = math.sqrt((end_point[0] - start_point[0]) ** 2 + (end_point[1] - start_point[1]) ** 2)
-            if check_line_length(distance, bigger_side_size):
-                return start_point, end_point
+        self.find_fingerprint_pixels()
+        stage_start = time.perf_counter()
+        attempt = 0
+        while self.within_budget(attempt, stage_start):
+            attempt += 1
+            self.count_attempt("two_points")
+            indices = self.np_random.randint(0, self.fingerprint_pixels.shape[0], size=(POINT_PAIRS_BATCH, 2))
+            start_points = self.fingerprint_pixels[indices[:, 0]]
+            end_points = self.fingerprint_pixels[indices[:, 1]]
+            distances = np.linalg.norm(end_points - start_points, axis=1)
+            valid = np.flatnonzero(check_line_length(distances, bigger_side_size))
+            if len(valid) > 0:
+                # fingerprint pixels are in (y,x) format
+                start_y, start_x = start_points[valid[0]]
+                end_y, end_x = end_points[valid[0]]
+                return (int(start_x), int(start_y)), (int(end_x), int(end_y))
+        raise GenerationBudgetExceeded("two_points", self.attempt_counters)
 
     def quadratic_bezier(self, start_point, end_point, control_point):
         """
 
-        @brief: Calculates points of bezier curve given by start, end and control point
+        @brief: Calculates points of bezier curve given by start, end and control point. Amount of points is based on
+                length of control polygon (upper bound of curve length), so neighbouring points are at most one pixel
+                apart
         :param start_point: Starting point of bezier curve in as (x,y) coordinates
         :param end_point: End point of bezier curve as (x,y) coordinates
         :param control_point: Control point of bezier curve as (x,y) coordinates
         :return: None
         """
+        start_point = np.asarray(start_point, dtype=float)
+        end_point = np.asarray(end_point, dtype=float)
+        control_point = np.asarray(control_point, dtype=float)
 
-        bezier_points = np.array([])
-        for i in range(0, 1001, 1):
-            t = i / 1000
-
-            point_x = self.calculate_x(start_point, end_point, control_point, t)
-            point_y = self.calculate_y(start_point, end_point, control_point, t)
+        polygon_length = np.linalg.norm(control_point - start_point) + np.linalg.norm(end_point - control_point)
+        amount_of_points = max(int(math.ceil(polygon_length)), 1) + 1
 
-            bezier_points = np.append(bezier_points, [point_x, point_y], axis=0)
-
-        bezier_points = bezier_points.reshape(-1, 2)
+        t = np.linspace(0, 1, amount_of_points)[:, np.newaxis]
+        bezier_points = (1 - t) ** 2 * start_point + 2 * (1 - t) * t * control_point + t ** 2 * end_point
         bezier_points = bezier_points.astype(int)
-        self.points = bezier_points
-
-    def calculate_x(self, start_point, end_point, control_point, t):
-        """
-
-        @brief: calculates x coordinate of point in bezier curve
-        :param start_point: Starting point of bezier curve
-        :param end_point: End point of bezier curve
-        :param control_point: Control point of bezier curve
-        :param t: step (between 0-1)
-        :return: x coordinate of point
-        """
-        start_x = start_point[0]
-        end_x = end_point[0]
-        control_x = control_point[0]
-        point_x = int(
-            math.pow(1 - t, 2) * start_x + 2 * (1 - t) * t * control_x + math.pow(t, 2) * end_x)
-
-        if point_x < 0:
-            point_x = 0
-
-        if point_x >= self.fingerprint.img_width:
-            point_x = self.fingerprint.img_width - 1
-        return point_x
-
-    def calculate_y(self, start_point, end_point, control_point, t):
-        """
-
-        @brief: calculates y coordinate of point in bezier curve
-        :param start_point: Starting point of bezier curve as (x,y) coordinates
-        :param end_point: End point of bezier curve  as (x,y) coordinates
-        :param control_point: Control point of bezier curve  as (x,y) coordinates
-        :param t: step (between 0-1)
-        :return: y coordinate of point
-        """
-        start_y = start_point[1]
-        end_y = end_point[1]
-        control_y = control_point[1]
-
-        point_y = int(
-            math.pow(1 - t, 2) * start_y + 2 * (1 - t) * t * control_y + math.pow(t, 2) * end_y)
-        if point_y < 0:
-            point_y = 0
-        if point_y >= self.fingerprint.img_height:
-            point_y = self.fingerprint.img_height - 1
-        return point_y
+        self.points = np.clip(bezier_points, 0, (self.fingerprint.img_width - 1, self.fingerprint.img_height - 1))
 
     def crease_irregularities(self, width):
         """
 
-        @brief: On every point of bezier line draws white circle with radius size depending on line width shifted
-        by random amount in axis x and y, creating irregular line
+        @brief: On every detail point of bezier line draws white circles with radius size depending on line width
+        shifted by random amount in axis x and y, creating irregular line. All circles are drawn in one pass
         :param width: width of crease
         :return: None
         """
@@ -256,24 +265,21 @@ class HairGenerator(Generator):
         if circle_radius <= 0:
             circle_radius = 1
 
-        for p in self.points:
-            x = rnd.randrange(0, 3)
-            for x in range(0, x):
-                if width > 5:
-                    variance = int(circle_radius / 3)
-                else:
-                    variance = 2
-
-                if variance != 0:
-                    x_variance = rnd.randrange(-variance, variance + 1)
-                    y_variance = rnd.randrange(-variance, variance + 1)
-                else:
-                    x_variance = rnd.choice((-1, 1))
-                    y_variance = rnd.choice((-1, 1))
-
-                new_x = p[0] + x_variance
-                new_y = p[1] + y_variance
-                cv.circle(self.damage_canvas, (new_x, new_y), circle_radius, (255, 0, 255), -1)
+        if width > 5:
+            variance = int(circle_radius / 3)
+        else:
+            variance = 2
+
+        # every detail point of bezier line gets 0-2 circles, all jittered centers are computed at once
+        points = self.get_detail_points()
+        amounts = self.np_random.randint(0, 3, size=len(points))
+        centers = np.repeat(points, amounts, axis=0)
+        if variance != 0:
+            centers += self.np_random.randint(-variance, variance + 1, size=centers.shape)
+        else:
+            centers += self.np_random.choice((-1, 1), size=centers.shape)
+        centers = np.unique(centers, axis=0)
+        self.draw_disks(self.damage_canvas, centers, circle_radius, 255)
 
     def all_points_outside_fingerprint_area(self):
         """
@@ -281,11 +287,5 @@ class HairGenerator(Generator):
         @brief: Checks if control points of bezier curve lie within fingerprint area
         :return: True or False
         """
-        outside_points = 0
-        for point in self.points:
-            # control points are in (x,y) format, coordinates must be swapped
-            if self.background_mask[point[1], point[0]] == 0:
-                outside_points += 1
-        if outside_points >= len(self.points):
-            return True
-        return False
+        # control points are in (x,y) format, coordinates must be swapped
+        return bool(np.all(self.background_mask[self.points[:, 1], self.points[:, 0]] == 0))
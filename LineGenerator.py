@@ -5,12 +5,14 @@
 # Date        : 8.5.2022
 # Version     : 1.0
 
-from Generator import Generator
+from Generator import Generator, GenerationBudgetExceeded
+from Profiler import span
+import Metrics
 
 import math
+import time
 import cv2 as cv
 import numpy as np
-import random as rnd
 import enum
 
 BLACK = 0
@@ -44,8 +46,8 @@ class LineGenerator(Generator):
     Class implementation of irregular line with variable width, that can be used as crease
     """
 
-    def __init__(self, fingerprint):
-        super().__init__(fingerprint)
+    def __init__(self, fingerprint, rng=None):
+        super().__init__(fingerprint, rng)
         self.control_points = None
         self.orientation = None
         self.length_type = None
@@ -54,7 +56,8 @@ class LineGenerator(Generator):
         self.length = None
         self.damage_canvas = None
         self.max_width = None
-
+        # optional function receiving control points, returns True if line should be rejected before it is drawn
+        self.reject_control_points = None
 
     @staticmethod
     def distance(point_1, point_2):
@@ -78,18 +81,18 @@ class LineGenerator(Generator):
         :return: None
         """
         if length == LineLength.RANDOM:
-            self.length_type = rnd.choice((LineLength.SHORT, LineLength.MEDIUM, LineLength.LONG))
+            self.length_type = self.rnd.choice((LineLength.SHORT, LineLength.MEDIUM, LineLength.LONG))
         else:
             self.length_type = length
 
         if orientation == LineOrientation.RANDOM:
-            self.orientation = rnd.choice((
+            self.orientation = self.rnd.choice((
                 LineOrientation.HORIZONTAL, LineOrientation.VERTICAL, LineOrientation.DIAGONAL))
         else:
             self.orientation = orientation
 
         if thickness == LineThickness.RANDOM:
-            self.thickness = rnd.choice((LineThickness.THIN, LineThickness.MEDIUM, LineThickness.THICK))
+            self.thickness = self.rnd.choice((LineThickness.THIN, LineThickness.MEDIUM, LineThickness.THICK))
         else:
             self.thickness = thickness
 
@@ -97,7 +100,7 @@ class LineGenerator(Generator):
                       thickness=LineThickness.RANDOM):
         """
 
-        @brief: Generates line specified by parameters
+        @brief: Generates line specified by parameters and draws it into fingerprint
         :param length_type: LineLength enum value
         :param orientation: LineOrientation enum value
         :param thickness:   LineThickness enum value
@@ -108,30 +111,96 @@ class LineGenerator(Generator):
             print("Synthetic fingerprint image is not available")
             return
 
+        self.propose_line(length_type, orientation, thickness)
+        self.commit_line()
+
+    def propose_line(self, length_type=LineLength.RANDOM, orientation=LineOrientation.RANDOM,
+                     thickness=LineThickness.RANDOM):
+        """
+
+        @brief: Generates line specified by parameters into damage canvas only, background is not changed. Line whose
+                control points are rejected by reject_control_points is not drawn, rejection does not use sampling
+                budget of line, so it never relaxes length of line
+        :param length_type: LineLength enum value
+        :param orientation: LineOrientation enum value
+        :param thickness:   LineThickness enum value
+        :return: True if line was drawn, False if it was rejected by reject_control_points
+        """
         self.set_line_type(length_type, orientation, thickness)
         self.damage_canvas = self.create_damage_canvas()
 
+        # adding more thickness points to thick lines to make line thinning more obvious
+        if self.thickness is LineThickness.THICK:
+            width_points = 3
+        else:
+            width_points = 1
+        # Iterate until line of given parameters that is mostly inside fingerprint is generated
+        with span("sample_geometry"):
+            self.sample_control_points(self.half_points_outside, width_points)
+            if self.reject_control_points is not None and self.reject_control_points(self.control_points):
+                return False
+
+        with span("rasterize"):
+            self.thicken_line()
+        with span("edges"):
+            self.irregular_edges()
+        return True
+
+    def commit_line(self):
+        """
+
+        @brief: Draws line from damage canvas into fingerprint area of background
+        :return: None
+        """
+        with span("composite"):
+            self.draw_on_background()
+        self.composite_damage()
+
+    def sample_control_points(self, is_rejected, width_points=0):
+        """
+
+        @brief: Generates control points of line until line is not rejected. Every length type has its own attempt and
+                time budget - if budget runs out, length type is relaxed to shorter one. If even short line can not be
+                generated, GenerationBudgetExceeded is raised
+        :param is_rejected: function returning True if generated control points are rejected
+        :param width_points: how many times are width points added before control points are checked
+        :return: None
+        """
         while True:
-            # Iterate until line of given parameters that is mostly inside fingerprint is generated
-            while True:
+            stage_start = time.perf_counter()
+            attempt = 0
+            while self.within_budget(attempt, stage_start):
+                attempt += 1
+                self.count_attempt("line")
                 point1, point2 = self.generate_start_end_point()
-                if point1 != -1:
-                    break
-            self.get_control_points(point1, point2)
-            self.move_control_points()
-            self.add_width_points()
-
-            if self.thickness is LineThickness.THICK:
-                # adding more thickness points to make line thinning more obvious
-                self.add_width_points()
-                self.add_width_points()
-            if self.half_points_outside() is False:
-                break
-
-        self.thicken_line()
-        self.irregular_edges()
-        self.draw_on_background()
-        self.crop_by_mask()
+                if point1 == -1:
+                    Metrics.count("start_end_point_failures")
+                    continue
+                self.get_control_points(point1, point2)
+                self.move_control_points()
+                for i in range(0, width_points):
+                    self.add_width_points()
+                if is_rejected() is False:
+                    return
+                Metrics.count("line_rejections")
+
+            if self.relax_length_type() is False:
+                raise GenerationBudgetExceeded("line", self.attempt_counters)
+
+    def relax_length_type(self):
+        """
+
+        @brief: Changes length type to the next shorter one
+        :return: True if length type was relaxed, False if line is already short
+        """
+        if self.length_type is LineLength.LONG:
+            self.length_type = LineLength.MEDIUM
+        elif self.length_type is LineLength.MEDIUM:
+            self.length_type = LineLength.SHORT
+        else:
+            return False
+        self.count_attempt("relax_length")
+        return True
 
     def get_edge_coordinates(self):
         """
@@ -153,13 +222,17 @@ class LineGenerator(Generator):
         :return: None
         """
         edge_points = self.get_edge_coordinates()
+        circles = 0
         for p in edge_points:
-            generate = rnd.randrange(0, 10)
+            generate = self.rnd.randrange(0, 10)
             if generate < 4:
                 cv.circle(self.damage_canvas, (p[1], p[0]), self.max_width // 7, 0, -1)
-            generate = rnd.choice((0, 1))
+                circles += 1
+            generate = self.rnd.choice((0, 1))
             if generate:
                 cv.circle(self.damage_canvas, (p[1], p[0]), 1, 0, -1)
+                circles += 1
+        Metrics.count("edge_circles", circles)
 
     def get_max_width(self):
         """
@@ -173,21 +246,21 @@ class LineGenerator(Generator):
             max_thickness = bigger_side // 20
             if max_thickness < 1:
                 max_thickness = 1
-            variance = rnd.randrange(0, +max_thickness // 2)
+            variance = self.rnd.randrange(0, +max_thickness // 2)
             max_thickness += variance
 
         elif self.thickness == LineThickness.MEDIUM:
             max_thickness = bigger_side // 35
             if max_thickness < 1:
                 max_thickness = 1
-            variance = rnd.randrange(0, +max_thickness // 2)
+            variance = self.rnd.randrange(0, +max_thickness // 2)
             max_thickness += variance
 
         elif self.thickness == LineThickness.THIN:
             max_thickness = bigger_side // 60
             if max_thickness < 1:
                 max_thickness = 1
-            variance = rnd.randrange(0, (max_thickness // 3 * 2))
+            variance = self.rnd.randrange(0, (max_thickness // 3 * 2))
 
             max_thickness += variance
 
@@ -203,7 +276,8 @@ class LineGenerator(Generator):
         """
 
         self.max_width = self.get_max_width()
-        max_thickness_point = rnd.randrange(0, len(self.control_points) - 1)
+        max_thickness_point = self.rnd.randrange(0, len(self.control_points) - 1)
+        Metrics.count("line_segments", len(self.control_points) - 1)
 
         segments_to_left = max_thickness_point
         for i in range(0, max_thickness_point):
@@ -230,11 +304,11 @@ class LineGenerator(Generator):
         :return: control points - list of (x,y) points
         """
         if self.length_type is LineLength.SHORT:
-            num_of_points = rnd.randrange(3, 6)
+            num_of_points = self.rnd.randrange(3, 6)
         elif self.length_type is LineLength.MEDIUM:
-            num_of_points = rnd.randrange(3, 7)
+            num_of_points = self.rnd.randrange(3, 7)
         elif self.length_type is LineLength.LONG:
-            num_of_points = rnd.randrange(3, 9)
+            num_of_points = self.rnd.randrange(3, 9)
         self.control_points = np.linspace(start_point, end_point, num_of_points)
         self.control_points = self.control_points.astype(int)
         return self.control_points
@@ -245,11 +319,7 @@ class LineGenerator(Generator):
         @brief: determines if more than half control points of generated line lie outside of fingerprint
         :return: True if more than half control point lies outside of fingerprint area, False if not
         """
-
-        outside_points = 0
-        for point in self.control_points:
-            if self.point_outside(point[1], point[0]):
-                outside_points += 1
+        outside_points = np.count_nonzero(self.points_outside(self.control_points))
         if outside_points >= (len(self.control_points) // 2):
             return True
         return False
@@ -266,6 +336,15 @@ class LineGenerator(Generator):
             return True
         return False
 
+    def points_outside(self, points):
+        """
+
+        @brief: Determines for every point if it is outside based on color of given pixels in mask
+        :param points: array of (x,y) coordinates
+        :return: boolean array, True for points outside of fingerprint area
+        """
+        return self.background_mask[points[:, 1], points[:, 0]] == BLACK
+
     def move_control_points(self):
         """
 
@@ -277,29 +356,9 @@ class LineGenerator(Generator):
         if max_displacement < 3:
             max_displacement = 3
 
-        if self.orientation is LineOrientation.DIAGONAL:
-
-            for point in self.control_points:
-                displacement_x = rnd.randrange(2, max_displacement + 1)
-                point[0] = point[0] + displacement_x
-                displacement_y = rnd.randrange(2, max_displacement + 1)
-                point[1] = point[1] + displacement_y
-
-                if point[0] >= self.fingerprint.img_width:
-                    point[0] = self.fingerprint.img_width - 1
-                if point[1] >= self.fingerprint.img_height:
-                    point[1] = self.fingerprint.img_height - 1
-
-        else:
-            for point in self.control_points:
-                displacement_y = rnd.randrange(2, max_displacement + 1)
-                displacement_x = rnd.randrange(2, max_displacement + 1)
-                point[0] += displacement_x
-                point[1] += displacement_y
-                if point[0] >= self.fingerprint.img_width:
-                    point[0] = self.fingerprint.img_width - 1
-                if point[1] >= self.fingerprint.img_height:
-                    point[1] = self.fingerprint.img_height - 1
+        displacement = self.np_random.randint(2, max_displacement + 1, size=self.control_points.shape)
+        self.control_points = np.minimum(self.control_points + displacement,
+                                         (self.fingerprint.img_width - 1, self.fingerprint.img_height - 1))
 
     def add_width_points(self):
         """
@@ -307,34 +366,12 @@ class LineGenerator(Generator):
         @brief Adds point between two control points
         :return: None
         """
-        mid_points = np.array([])
-
-        index = 0
-        for point in self.control_points:
-            next_index = index + 1
-            if next_index > len(self.control_points) - 1:
-                break
-
-            next_point = self.control_points[next_index]
-            mid_point_x = (point[0] + next_point[0]) // 2
-            mid_point_y = (point[1] + next_point[1]) // 2
-            index += 1
-            mid_points = np.append(mid_points, [mid_point_x, mid_point_y], axis=0)
-
-        mid_points = mid_points.reshape(-1, 2)
-        mid_points = mid_points.astype(int)
-        merge_points = np.array([])
-
-        # merge mid_points with control points
-        i = 0
-        while i < (len(self.control_points)):
-            merge_points = np.append(merge_points, self.control_points[i])
-            if i < len(mid_points):
-                merge_points = np.append(merge_points, mid_points[i])
-            i += 1
-
-        merge_points = merge_points.reshape(-1, 2)
-        merge_points = merge_points.astype(int)
+        mid_points = (self.control_points[:-1] + self.control_points[1:]) // 2
+
+        # interleave mid_points with control points
+        merge_points = np.empty((len(self.control_points) + len(mid_points), 2), dtype=int)
+        merge_points[0::2] = self.control_points
+        merge_points[1::2] = mid_points
         self.control_points = merge_points
 
     def generate_start_end_point(self):
@@ -343,6 +380,7 @@ class LineGenerator(Generator):
         @brief:  Generates start and end point of line based line type (orientation and length)
         :return: start and end point of line as (x,y) coordinates
         """
+        self.count_attempt("start_end_point")
 
         width = self.fingerprint.fingerprint_width
         height = self.fingerprint.fingerprint_height
@@ -351,25 +389,56 @@ class LineGenerator(Generator):
         scale, angle = self.get_scale_and_angle(width, height, diagonal)
         min_value, max_value = self.get_length_range(scale)
 
-        self.length = rnd.randrange(min_value, max_value + 1)
+        self.length = self.rnd.randrange(min_value, max_value + 1)
         radian_angle = angle * (math.pi / 180)
+        shift_x = int(self.length * math.cos(radian_angle))
+        shift_y = int(self.length * math.sin(radian_angle))
+
+        # start points with both ends of line inside fingerprint are preferred, if there are none, any start point
+        # with end point inside image is used
+        start_region = self.get_start_region(shift_x, shift_y, self.background_mask)
+        start_indices = np.flatnonzero(start_region)
+        if len(start_indices) == 0:
+            start_region = self.get_start_region(shift_x, shift_y, None)
+            start_indices = np.flatnonzero(start_region)
+            # line of given length and angle does not fit into image
+            if len(start_indices) == 0:
+                return -1, -1
 
-        counter = 0
-        while True:
-            x1 = rnd.randrange(0, self.fingerprint.img_width)
-            y1 = rnd.randrange(0, self.fingerprint.img_height)
-            x2 = int(x1 + self.length * math.cos(radian_angle))
-            y2 = int(y1 + self.length * math.sin(radian_angle))
-
-            if (x2 in range(0, self.fingerprint.img_width)) and (y2 in range(0, self.fingerprint.img_height)):
-                break
-            counter += 1
+        y1, x1 = np.unravel_index(start_indices[self.rnd.randrange(0, len(start_indices))], start_region.shape)
+        x1 = int(x1)
+        y1 = int(y1)
+        return (x1, y1), (x1 + shift_x, y1 + shift_y)
 
-            # avoiding infinite cycling if method fails to generate line of given length and angle
-            if counter > 100:
-                return -1, -1
+    def get_start_region(self, shift_x, shift_y, mask):
+        """
 
-        return (x1, y1), (x2, y2)
+        @brief: Computes map of all valid start points of line given by shift between its start and end point. Valid
+                start point lies inside mask and so does the end point - map is mask intersected with its own copy
+                shifted by the length vector
+        :param shift_x: shift between start and end point in x axis
+        :param shift_y: shift between start and end point in y axis
+        :param mask: mask of allowed points, if None, whole image is allowed
+        :return: map of valid start points as array of image size (nonzero value means valid start point)
+        """
+        height = self.fingerprint.img_height
+        width = self.fingerprint.img_width
+        start_region = np.zeros((height, width), np.uint8)
+
+        y_start = max(0, -shift_y)
+        y_end = min(height, height - shift_y)
+        x_start = max(0, -shift_x)
+        x_end = min(width, width - shift_x)
+        if y_start >= y_end or x_start >= x_end:
+            return start_region
+
+        if mask is None:
+            start_region[y_start:y_end, x_start:x_end] = WHITE
+        else:
+            start_region[y_start:y_end, x_start:x_end] = cv.bitwise_and(
+                mask[y_start:y_end, x_start:x_end],
+                mask[y_start + shift_y:y_end + shift_y, x_start + shift_x:x_end + shift_x])
+        return start_region
 
     def get_length_range(self, scale):
         """
@@ -401,23 +470,23 @@ class LineGenerator(Generator):
         :return: scale and randomly generated angle of line (both as integers)
         """
         if self.orientation is LineOrientation.HORIZONTAL:
-            angle = rnd.choice((0, 180))
-            variance = rnd.randrange(0, 10)
+            angle = self.rnd.choice((0, 180))
+            variance = self.rnd.randrange(0, 10)
             angle += variance
             if angle < 0:
                 angle = 360 + angle
             scale = width
 
         elif self.orientation is LineOrientation.VERTICAL:
-            angle = rnd.choice((90, 270))
-            variance = rnd.randrange(-10, 10)
+            angle = self.rnd.choice((90, 270))
+            variance = self.rnd.randrange(-10, 10)
             angle += variance
             if angle < 0:
                 angle = 360 + angle
             scale = height
         elif self.orientation is LineOrientation.DIAGONAL:
-            angle = rnd.choice((45, 135, 225, 315))
-            variance = rnd.randrange(-35, 35)
+            angle = self.rnd.choice((45, 135, 225, 315))
+            variance = self.rnd.randrange(-35, 35)
             angle += variance
             if angle < 0:
                 angle = 360 + angle
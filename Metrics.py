@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Created By  : Vanessa Jóriová
+# Date        : 8.5.2022
+# Version     : 1.0
+
+import threading
+import time
+
+# prefix of all metrics in Prometheus exposition
+METRIC_PREFIX = "fingerprint_damage_"
+
+# descriptions of counters, counters of sampling stages (<stage>_attempts) are described automatically
+COUNTER_DESCRIPTIONS = {
+    "start_end_point_failures": "Lines without any valid start point",
+    "line_rejections": "Lines rejected because their control points lie outside of fingerprint",
+    "line_segments": "Line segments drawn by thicken_line",
+    "edge_circles": "Circles drawn by irregular_edges",
+    "irregularity_circles": "Circles drawn by line_irregularity of scars",
+    "patch_circles": "Circles drawn by black patches of scar artifacts",
+    "disk_draw_calls": "Calls of draw_disks",
+    "disks_drawn": "Disks drawn by draw_disks (scar outline, hair opacity, hair crease irregularities)",
+    "soak_circles": "Soak distortions applied by distort_edges",
+    "crease_rejections": "Creases discarded because they overlap with other creases",
+    "crease_occupancy_rejections": "Creases rejected before drawing because occupancy grid shows overlap",
+    "crease_skips": "Creases skipped because they could not be generated within budget",
+}
+
+# registry of this process, None if metrics are disabled
+active_registry = None
+
+
+def count(name, amount=1):
+    """
+
+    @brief: Increments counter of image which is currently generated, does nothing if metrics are disabled
+    :param name: name of counter
+    :param amount: increment
+    :return: None
+    """
+    if active_registry is not None:
+        active_registry.count(name, amount)
+
+
+def enable():
+    """
+
+    @brief: Enables metrics in this process
+    :return: MetricsRegistry instance
+    """
+    global active_registry
+    if active_registry is None:
+        active_registry = MetricsRegistry()
+    return active_registry
+
+
+def describe(name):
+    """
+
+    @brief: Gets description of counter
+    :param name: name of counter
+    :return: description as string
+    """
+    if name in COUNTER_DESCRIPTIONS:
+        return COUNTER_DESCRIPTIONS[name]
+    if name.endswith("_attempts"):
+        return f"Attempts of sampling stage {name[:-len('_attempts')]}"
+    return name
+
+
+class MetricsRegistry:
+    """
+    Class collecting hot-path counters of generated images. Every image has its own record:
+        :image      name of image
+        :damage     damage types of image joined by + (e.g. creases+hair)
+        :steps      parameters of damage steps
+        :seconds    time of image in seconds
+        :counters   value of every counter
+    Every thread has its own current image, so images can be generated in worker threads
+    """
+
+    def __init__(self):
+        self.records = []
+        self.state = threading.local()
+
+    def start_image(self, image, steps):
+        """
+
+        @brief: Starts record of new image, following counts are added to it
+        :param image: name of image
+        :param steps: damage steps of image as JSON serializable dictionaries
+        :return: None
+        """
+        self.state.current = {"image": image, "damage": "+".join(step["damage"] for step in steps), "steps": steps,
+                              "counters": {}}
+        self.state.image_start = time.perf_counter()
+
+    def finish_image(self):
+        """
+
+        @brief: Finishes record of current image
+        :return: None
+        """
+        current = getattr(self.state, "current", None)
+        if current is None:
+            return
+        current["seconds"] = time.perf_counter() - self.state.image_start
+        self.records.append(current)
+        self.state.current = None
+
+    def count(self, name, amount=1):
+        """
+
+        @brief: Increments counter of current image, counts outside of image are ignored
+        :param name: name of counter
+        :param amount: increment
+        :return: None
+        """
+        current = getattr(self.state, "current", None)
+        if current is not None:
+            counters = current["counters"]
+            counters[name] = counters.get(name, 0) + amount
+
+    def take_records(self):
+        """
+
+        @brief: Removes finished records from registry, used to send records of worker process to main process
+        :return: list of records
+        """
+        records = self.records
+        self.records = []
+        return records
+
+    def add_records(self, records):
+        """
+
+        @brief: Adds records of images generated by other process
+        :param records: list of records
+        :return: None
+        """
+        self.records.extend(records)
+
+    def get_totals(self):
+        """
+
+        @brief: Sums counters, images and time of whole run for every damage type
+        :return: dictionary damage -> {"images", "seconds", "counters"}
+        """
+        totals = {}
+        for record in self.records:
+            total = totals.setdefault(record["damage"], {"images": 0, "seconds": 0.0, "counters": {}})
+            total["images"] += 1
+            total["seconds"] += record["seconds"]
+            for name, value in record["counters"].items():
+                total["counters"][name] = total["counters"].get(name, 0) + value
+        return totals
+
+    def summary(self):
+        """
+
+        @brief: Creates text summary - totals of run for every damage type and counters of every image sorted from the
+                slowest image
+        :return: summary as string
+        """
+        lines = ["Run totals"]
+        for damage, total in sorted(self.get_totals().items()):
+            lines.append(f"  {damage}: {total['images']} images, {total['seconds']:.2f} s")
+            for name, value in sorted(total["counters"].items()):
+                lines.append(f"    {name:<28}{value:>12}  ({value / total['images']:.1f} per image)")
+
+        lines.append("Images (slowest first)")
+        for record in sorted(self.records, key=lambda record: record["seconds"], reverse=True):
+            counters = ", ".join(f"{name}={value}" for name, value in sorted(record["counters"].items()))
+            lines.append(f"  {record['image']:<30}{record['seconds']:>8.3f} s  {record['damage']}  {counters}")
+            lines.append(f"    steps: {record['steps']}")
+        return "\n".join(lines) + "\n"
+
+    def prometheus(self):
+        """
+
+        @brief: Creates Prometheus text exposition of run totals, every metric is labeled by damage type
+        :return: exposition as string
+        """
+        totals = self.get_totals()
+        names = sorted({name for total in totals.values() for name in total["counters"]})
+        lines = [f"# HELP {METRIC_PREFIX}images_total Generated images",
+                 f"# TYPE {METRIC_PREFIX}images_total counter"]
+        lines += [f'{METRIC_PREFIX}images_total{{damage="{damage}"}} {total["images"]}'
+                  for damage, total in sorted(totals.items())]
+        lines += [f"# HELP {METRIC_PREFIX}image_seconds_total Time of generating images",
+                  f"# TYPE {METRIC_PREFIX}image_seconds_total counter"]
+        lines += [f'{METRIC_PREFIX}image_seconds_total{{damage="{damage}"}} {total["seconds"]:.6f}'
+                  for damage, total in sorted(totals.items())]
+        for name in names:
+            metric = f"{METRIC_PREFIX}{name}_total"
+            lines += [f"# HELP {metric} {describe(name)}", f"# TYPE {metric} counter"]
+            lines += [f'{metric}{{damage="{damage}"}} {total["counters"].get(name, 0)}'
+                      for damage, total in sorted(totals.items())]
+        return "\n".join(lines) + "\n"
+
+    def save(self, path, prometheus=False):
+        """
+
+        @brief: Saves metrics into file
+        :param path: path to file
+        :param prometheus: True saves Prometheus exposition, False text summary
+        :return: None
+        """
+        with open(path, "w") as metrics_file:
+            metrics_file.write(self.prometheus() if prometheus else self.summary())
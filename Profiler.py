@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Created By  : Vanessa Jóriová
+# Date        : 8.5.2022
+# Version     : 1.0
+
+import contextlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+# edges of histogram bins of stage times in milliseconds
+HISTOGRAM_BINS_MS = [0, 0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, float("inf")]
+
+PERCENTILES = [50, 90, 99]
+
+# pipeline stage (track of trace) of every span stage
+PIPELINE_STAGES = {
+    "load": "load",
+    "mask": "load",
+    "sample_geometry": "generate",
+    "rasterize": "generate",
+    "edges": "generate",
+    "distortion": "generate",
+    "composite": "generate",
+    "threshold": "generate",
+    "encode": "encode",
+    "write": "write",
+}
+
+# tracks of every worker in trace, image track contains whole images
+TRACE_TRACKS = ["image", "load", "generate", "encode", "write"]
+
+# span returned when profiling is disabled, it does not measure anything
+NULL_SPAN = contextlib.nullcontext()
+
+# profiler of this process, None if profiling is disabled
+active_profiler = None
+
+
+def span(stage):
+    """
+
+    @brief: Creates span measuring time of code block of given stage, e.g. with span("rasterize"): ... When profiling
+            is disabled, shared empty span is returned, so disabled profiling costs only this call
+    :param stage: name of stage
+    :return: context manager
+    """
+    if active_profiler is None:
+        return NULL_SPAN
+    return Span(active_profiler, stage)
+
+
+def enable(trace=False):
+    """
+
+    @brief: Enables profiling in this process
+    :param trace: True also records start and end of every span, so spans can be exported as trace
+    :return: Profiler instance
+    """
+    global active_profiler
+    if active_profiler is None:
+        active_profiler = Profiler()
+    active_profiler.trace = active_profiler.trace or trace
+    return active_profiler
+
+
+class Span:
+    """
+    Context manager adding time of code block to stage of image which is currently generated
+    """
+
+    def __init__(self, profiler, stage):
+        """
+
+        :param profiler: Profiler instance
+        :param stage: name of stage
+        """
+        self.profiler = profiler
+        self.stage = stage
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.add_span(self.stage, self.start, time.perf_counter())
+        return False
+
+
+class Profiler:
+    """
+    Class collecting stage times of generated images. Every image has its own record:
+        :image      name of image
+        :steps      parameters of damage steps of image
+        :library    True if damage was applied from damage library
+        :stages     total time of every stage in seconds
+        :total_s    time of whole image in seconds
+    In case of tracing, record also contains id of process and thread, start of image and list of spans as (stage,
+    start, end). Times are taken from time.perf_counter(), which is system-wide monotonic clock, so times of worker
+    processes can be compared. Every thread has its own current image, so images can be generated in worker threads
+    """
+
+    def __init__(self):
+        self.records = []
+        self.state = threading.local()
+        self.trace = False
+
+    def start_image(self, image, steps, library=False):
+        """
+
+        @brief: Starts record of new image, following spans are added to it
+        :param image: name of image
+        :param steps: damage steps of image as JSON serializable dictionaries
+        :param library: True if damage is applied from damage library
+        :return: None
+        """
+        self.state.current = {"image": image, "steps": steps, "library": library, "stages": {}}
+        self.state.image_start = time.perf_counter()
+        if self.trace:
+            self.state.current.update({"pid": os.getpid(), "thread": threading.get_ident(),
+                                       "start": self.state.image_start, "spans": []})
+
+    def finish_image(self):
+        """
+
+        @brief: Finishes record of current image
+        :return: None
+        """
+        current = getattr(self.state, "current", None)
+        if current is None:
+            return
+        current["total_s"] = time.perf_counter() - self.state.image_start
+        self.records.append(current)
+        self.state.current = None
+
+    def add_span(self, stage, start, end):
+        """
+
+        @brief: Adds time of span to stage of current image, spans outside of image are ignored
+        :param stage: name of stage
+        :param start: start of span in seconds
+        :param end: end of span in seconds
+        :return: None
+        """
+        current = getattr(self.state, "current", None)
+        if current is not None:
+            stages = current["stages"]
+            stages[stage] = stages.get(stage, 0) + end - start
+            if self.trace:
+                current["spans"].append((stage, start, end))
+
+    def take_records(self):
+        """
+
+        @brief: Removes finished records from profiler, used to send records of worker process to main process
+        :return: list of records
+        """
+        records = self.records
+        self.records = []
+        return records
+
+    def add_records(self, records):
+        """
+
+        @brief: Adds records of images generated by other process
+        :param records: list of records
+        :return: None
+        """
+        self.records.extend(records)
+
+    def aggregate(self):
+        """
+
+        @brief: Computes statistics and histogram of times of every stage over all images
+        :return: statistics as dictionary
+        """
+        times = {}
+        for record in self.records:
+            for stage, elapsed in record["stages"].items():
+                times.setdefault(stage, []).append(elapsed)
+            times.setdefault("total", []).append(record["total_s"])
+
+        stages = {}
+        for stage, values in times.items():
+            statistics = {"count": len(values), "total_s": float(np.sum(values)), "mean_s": float(np.mean(values))}
+            for percentile in PERCENTILES:
+                statistics[f"p{percentile}_s"] = float(np.percentile(values, percentile))
+            counts, edges = np.histogram(np.array(values) * 1000, HISTOGRAM_BINS_MS)
+            statistics["histogram"] = {"bin_edges_ms": HISTOGRAM_BINS_MS[:-1], "counts": counts.tolist()}
+            stages[stage] = statistics
+        return stages
+
+    def save(self, path):
+        """
+
+        @brief: Saves stage times of all images and aggregated statistics into JSON file
+        :param path: path to JSON file
+        :return: None
+        """
+        images = [{"image": record["image"], "steps": record["steps"], "library": record["library"],
+                   "stages": record["stages"], "total_s": record["total_s"]} for record in self.records]
+        with open(path, "w") as profile_file:
+            json.dump({"images": images, "stages": self.aggregate()}, profile_file, indent=2)
+
+    def save_trace(self, path):
+        """
+
+        @brief: Saves spans of all images in Chrome trace event format (viewable in Perfetto or chrome://tracing).
+                Every process (or worker thread) has its own track for whole images and track for every pipeline stage
+                (load, generate, encode, write)
+        :param path: path to JSON file
+        :return: None
+        """
+        records = [record for record in self.records if "spans" in record]
+        origin = min((record["start"] for record in records), default=0)
+        processes = {}
+        events = []
+        for record in records:
+            worker = (record["pid"], record["thread"])
+            if worker not in processes:
+                main = worker == (os.getpid(), threading.main_thread().ident)
+                processes[worker] = (len(processes) + 1, "main" if main else f"worker {len(processes) + 1}")
+            pid = processes[worker][0]
+            events.append({"name": record["image"], "cat": "image", "ph": "X", "pid": pid,
+                           "tid": TRACE_TRACKS.index("image"), "ts": (record["start"] - origin) * 1e6,
+                           "dur": record["total_s"] * 1e6})
+            for stage, start, end in record["spans"]:
+                track = PIPELINE_STAGES.get(stage, "generate")
+                events.append({"name": stage, "cat": track, "ph": "X", "pid": pid, "tid": TRACE_TRACKS.index(track),
+                               "ts": (start - origin) * 1e6, "dur": (end - start) * 1e6,
+                               "args": {"image": record["image"]}})
+
+        for pid, name in processes.values():
+            events.append({"name": "process_name", "ph": "M", "pid": pid, "args": {"name": name}})
+            for tid, track in enumerate(TRACE_TRACKS):
+                events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": track}})
+                events.append({"name": "thread_sort_index", "ph": "M", "pid": pid, "tid": tid,
+                               "args": {"sort_index": tid}})
+        with open(path, "w") as trace_file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, trace_file)
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Created By  : Vanessa Jóriová
+# Date        : 8.5.2022
+# Version     : 1.0
+
+import json
+import multiprocessing
+import sys
+import threading
+import time
+
+# default interval of progress reports in seconds
+DEFAULT_INTERVAL = 2.0
+
+
+class WorkerActivity:
+    """
+    Activity of workers shared by main process and worker processes or threads - start time of task currently generated
+    by every worker, amount of started and finished tasks and busy time of finished tasks. Workers update activity when
+    they start and finish task, so amount of running and queued tasks and utilization of workers are measured, not
+    derived from finished tasks
+    """
+
+    def __init__(self, workers):
+        """
+
+        :param workers: amount of workers
+        """
+        # wall clock start time of task of every worker (0 if worker is idle), comparable between processes
+        self.starts = multiprocessing.Array("d", workers, lock=False)
+        # amount of started tasks, amount of finished tasks and busy seconds of finished tasks
+        self.counters = multiprocessing.Array("d", 3)
+        self.next_slot = multiprocessing.Value("i", 0)
+
+    def register_worker(self):
+        """
+
+        @brief: Assigns slot to worker, called once by every worker
+        :return: slot of worker as integer
+        """
+        with self.next_slot.get_lock():
+            slot = self.next_slot.value % len(self.starts)
+            self.next_slot.value += 1
+        return slot
+
+    def reset(self):
+        """
+
+        @brief: Clears counters before new batch
+        :return: None
+        """
+        with self.counters.get_lock():
+            self.counters[:] = [0, 0, 0]
+            self.starts[:] = [0] * len(self.starts)
+
+    def task_started(self, slot):
+        """
+
+        @brief: Records start of task
+        :param slot: slot of worker
+        :return: None
+        """
+        with self.counters.get_lock():
+            self.counters[0] += 1
+            self.starts[slot] = time.time()
+
+    def task_finished(self, slot, seconds):
+        """
+
+        @brief: Records end of task
+        :param slot: slot of worker
+        :param seconds: time of task
+        :return: None
+        """
+        with self.counters.get_lock():
+            self.counters[1] += 1
+            self.counters[2] += seconds
+            self.starts[slot] = 0
+
+    def get_state(self):
+        """
+
+        @brief: Gets current activity of workers
+        :return: amount of started tasks, amount of running tasks and busy seconds of workers including time of
+                 running tasks
+        """
+        with self.counters.get_lock():
+            now = time.time()
+            starts = [start for start in self.starts if start > 0]
+            return int(self.counters[0]), len(starts), self.counters[2] + sum(now - start for start in starts)
+
+
+class ProgressReporter:
+    """
+    Class reporting progress of batch of images in fixed interval - amount of finished images, images per second
+    (overall and for every damage type), ETA, utilization of workers, amount of running tasks and amount of tasks
+    waiting in queue. Reports are printed as text lines or written as JSON lines (one JSON object per report), reports
+    are written also when no image is finished, so stalled batches can be detected
+    """
+
+    def __init__(self, total, workers=1, interval=DEFAULT_INTERVAL, json_path=None, activity=None):
+        """
+
+        :param total: amount of tasks in batch
+        :param workers: amount of workers generating tasks
+        :param interval: interval of reports in seconds
+        :param json_path: path to file to which JSON lines are appended ("-" for standard output), None prints text
+        :param activity: WorkerActivity updated by workers, None counts only finished tasks (no task is reported as
+                         running and utilization is credited when task is finished)
+        """
+        self.total = total
+        self.workers = workers
+        self.activity = activity
+        self.interval = interval
+        self.json_path = json_path
+        self.done = 0
+        self.saved = 0
+        self.busy_seconds = 0.0
+        self.damage_done = {}
+        self.start_time = None
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """
+
+        @brief: Starts reporting in background thread
+        :return: None
+        """
+        self.start_time = time.perf_counter()
+        self.thread = threading.Thread(target=self.report_periodically, daemon=True)
+        self.thread.start()
+
+    def report_periodically(self):
+        """
+
+        @brief: Writes report every interval until reporting is finished
+        :return: None
+        """
+        while not self.stop_event.wait(self.interval):
+            self.report()
+
+    def task_done(self, result):
+        """
+
+        @brief: Adds finished task to progress
+        :param result: result of task - dictionary with saved (True if image was saved), damage (damage types of
+                       image) and seconds (time of task)
+        :return: None
+        """
+        with self.lock:
+            self.done += 1
+            self.saved += result["saved"]
+            self.busy_seconds += result["seconds"]
+            self.damage_done[result["damage"]] = self.damage_done.get(result["damage"], 0) + 1
+
+    def finish(self):
+        """
+
+        @brief: Stops background reporting and writes final report
+        :return: None
+        """
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.report(final=True)
+
+    def get_snapshot(self, final=False):
+        """
+
+        @brief: Computes current progress
+        :param final: True if batch is finished
+        :return: progress as dictionary
+        """
+        if self.activity is not None:
+            started, running, busy_seconds = self.activity.get_state()
+        with self.lock:
+            if self.activity is None:
+                started, running, busy_seconds = self.done, 0, self.busy_seconds
+            elapsed = time.perf_counter() - self.start_time
+            rate = self.done / elapsed if elapsed > 0 else 0.0
+            remaining = self.total - self.done
+            return {
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "elapsed_s": round(elapsed, 3),
+                "done": self.done,
+                "saved": self.saved,
+                "skipped": self.done - self.saved,
+                "total": self.total,
+                "images_per_s": round(rate, 3),
+                "damage_images_per_s": {damage: round(done / elapsed, 3) if elapsed > 0 else 0.0
+                                        for damage, done in sorted(self.damage_done.items())},
+                "eta_s": round(remaining / rate, 1) if rate > 0 else None,
+                "worker_utilization": round(min(busy_seconds / (elapsed * self.workers), 1.0), 3)
+                if elapsed > 0 else 0.0,
+                "running": running,
+                "queued": max(self.total - started, 0),
+                "final": final,
+            }
+
+    @staticmethod
+    def format_snapshot(snapshot):
+        """
+
+        @brief: Formats progress as one line of text
+        :param snapshot: progress as dictionary
+        :return: formatted progress as string
+        """
+        width = len(str(snapshot["total"]))
+        percent = snapshot["done"] / snapshot["total"] * 100 if snapshot["total"] else 100.0
+        text = f"[{snapshot['done']:>{width}}/{snapshot['total']}] {percent:5.1f}%  " \
+               f"{snapshot['images_per_s']:.2f} img/s"
+        if snapshot["damage_images_per_s"]:
+            rates = ", ".join(f"{damage} {rate:.2f}" for damage, rate in snapshot["damage_images_per_s"].items())
+            text += f" ({rates})"
+        if snapshot["final"]:
+            text += f"  done in {snapshot['elapsed_s']:.1f} s"
+        elif snapshot["eta_s"] is not None:
+            text += f"  ETA {snapshot['eta_s']:.0f} s"
+        text += f"  workers {snapshot['worker_utilization']:.0%} busy, {snapshot['running']} running, " \
+                f"{snapshot['queued']} queued"
+        if snapshot["skipped"]:
+            text += f", {snapshot['skipped']} skipped"
+        return text
+
+    def report(self, final=False):
+        """
+
+        @brief: Writes current progress as text line or JSON line
+        :param final: True if batch is finished
+        :return: None
+        """
+        snapshot = self.get_snapshot(final)
+        if self.json_path is None:
+            print(self.format_snapshot(snapshot), flush=True)
+        elif self.json_path == "-":
+            sys.stdout.write(json.dumps(snapshot) + "\n")
+            sys.stdout.flush()
+        else:
+            with open(self.json_path, "a") as json_file:
+                json_file.write(json.dumps(snapshot) + "\n")
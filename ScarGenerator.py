@@ -8,10 +8,11 @@
 from LineGenerator import LineGenerator, LineOrientation, LineLength, LineThickness
 from ImageDistortion import *
 from FingerprintImage import FingerprintImage
+from Profiler import span
+import Metrics
 import math
 import cv2 as cv
 import numpy as np
-import random as rnd
 
 
 class ScarGenerator(LineGenerator):
@@ -19,8 +20,8 @@ class ScarGenerator(LineGenerator):
     Class capable of generating synthetic scar into synthetic fingerprint image
     """
 
-    def __init__(self, fingerprint):
-        super().__init__(fingerprint)
+    def __init__(self, fingerprint, rng=None):
+        super().__init__(fingerprint, rng)
         self.main_print = True
         self.max_width = None
         self.new_edges = None
@@ -47,19 +48,19 @@ class ScarGenerator(LineGenerator):
                 max_thickness = bigger_side // 25
                 if max_thickness < 1:
                     max_thickness = 1
-                variance = rnd.randrange(0, +max_thickness // 2)
+                variance = self.rnd.randrange(0, +max_thickness // 2)
                 max_thickness += variance
             elif self.thickness == LineThickness.MEDIUM:
                 max_thickness = bigger_side // 35
                 if max_thickness < 1:
                     max_thickness = 1
-                variance = rnd.randrange(0, +max_thickness // 2)
+                variance = self.rnd.randrange(0, +max_thickness // 2)
                 max_thickness += variance
             elif self.thickness == LineThickness.THIN:
                 max_thickness = bigger_side // 60
                 if max_thickness < 1:
                     max_thickness = 1
-                variance = rnd.randrange(0, +max_thickness // 2)
+                variance = self.rnd.randrange(0, +max_thickness // 2)
                 max_thickness += variance
 
         else:
@@ -67,19 +68,19 @@ class ScarGenerator(LineGenerator):
                 max_thickness = bigger_side // 6
                 if max_thickness < 1:
                     max_thickness = 1
-                variance = rnd.randrange(0, +max_thickness // 2)
+                variance = self.rnd.randrange(0, +max_thickness // 2)
                 max_thickness += variance
             elif self.thickness == LineThickness.MEDIUM:
                 max_thickness = bigger_side // 10
                 if max_thickness < 1:
                     max_thickness = 1
-                variance = rnd.randrange(0, +max_thickness // 2)
+                variance = self.rnd.randrange(0, +max_thickness // 2)
                 max_thickness += variance
             elif self.thickness == LineThickness.THIN:
                 max_thickness = bigger_side // 30
                 if max_thickness < 1:
                     max_thickness = 1
-                variance = rnd.randrange(0, +max_thickness // 2)
+                variance = self.rnd.randrange(0, +max_thickness // 2)
                 max_thickness += variance
 
         return max_thickness
@@ -97,7 +98,8 @@ class ScarGenerator(LineGenerator):
 
         if len(self.control_points) - 1 <= 5:
             max_thickness_point = (len(self.control_points) - 1)//2
-        max_thickness_point = rnd.randrange(2, len(self.control_points) - 2)
+        max_thickness_point = self.rnd.randrange(2, len(self.control_points) - 2)
+        Metrics.count("line_segments", len(self.control_points) - 1)
         segments_to_left = max_thickness_point
         segments_to_right = (len(self.control_points) - 1) - max_thickness_point
         for i in range(0, max_thickness_point):
@@ -143,15 +145,17 @@ class ScarGenerator(LineGenerator):
             circle_radius = 1
         radius_variance = circle_radius//3
         if radius_variance != 0:
-            circle_radius += rnd.randrange(0, radius_variance+1)
+            circle_radius += self.rnd.randrange(0, radius_variance+1)
         points_nmbr = int(distance / (circle_radius / 2))
         if points_nmbr == 0:
-            points_nmbr = rnd.choice((0, 1))
+            points_nmbr = self.rnd.choice((0, 1))
 
         points_on_line = np.linspace(point_1, point_2, points_nmbr)
         points_on_line = points_on_line.astype(int)
+        circles = 0
         for p in points_on_line:
-            x = rnd.randrange(0, 10)
+            x = self.rnd.randrange(0, 10)
+            circles += x
             for x in range(0, x):
 
                 if width > 5:
@@ -159,14 +163,15 @@ class ScarGenerator(LineGenerator):
                 else:
                     variance = 2
                 if variance != 0:
-                    x_variance = rnd.randrange(-variance, variance+1)
-                    y_variance = rnd.randrange(-variance, variance+1)
+                    x_variance = self.rnd.randrange(-variance, variance+1)
+                    y_variance = self.rnd.randrange(-variance, variance+1)
                 else:
-                    x_variance = rnd.choice((-1, 2))
-                    y_variance = rnd.choice((-1, 2))
+                    x_variance = self.rnd.choice((-1, 2))
+                    y_variance = self.rnd.choice((-1, 2))
                 new_x = p[0] + x_variance
                 new_y = p[1] + y_variance
                 cv.circle(self.damage_canvas, (new_x, new_y), circle_radius, 255, -1)
+        Metrics.count("irregularity_circles", circles)
 
     def generate_line(self, length_type=LineLength.RANDOM, orientation=LineOrientation.RANDOM,
                       thickness=LineThickness.RANDOM):
@@ -185,65 +190,61 @@ class ScarGenerator(LineGenerator):
         self.damage_canvas = np.zeros(self.fingerprint.img.shape[:2], np.uint8)
 
         if length_type == LineLength.RANDOM:
-            self.length_type = rnd.choice((LineLength.SHORT, LineLength.MEDIUM, LineLength.LONG))
+            self.length_type = self.rnd.choice((LineLength.SHORT, LineLength.MEDIUM, LineLength.LONG))
         else:
             self.length_type = length_type
 
         if orientation == LineOrientation.RANDOM:
-            self.orientation = rnd.choice((
+            self.orientation = self.rnd.choice((
                 LineOrientation.HORIZONTAL, LineOrientation.VERTICAL, LineOrientation.DIAGONAL))
         else:
             self.orientation = orientation
 
         if thickness == LineThickness.RANDOM:
-            self.thickness = rnd.choice((LineThickness.THIN, LineThickness.MEDIUM, LineThickness.THICK))
+            self.thickness = self.rnd.choice((LineThickness.THIN, LineThickness.MEDIUM, LineThickness.THICK))
         else:
             self.thickness = thickness
 
-        while True:
-
-            while True:
-                point1, point2 = self.generate_start_end_point()
-                if point1 != -1:
-                    break
-            self.get_control_points(point1, point2)
-
-            self.move_control_points()
-
-            if self.more_than_one_point_outside() is False:
-                break
-        self.add_width_points()
-        if (self.thickness is LineThickness.THICK) and (self.line_irregularities is False):
-            self.add_width_points()
+        with span("sample_geometry"):
+            self.sample_control_points(self.more_than_one_point_outside)
             self.add_width_points()
-
-        if self.line_irregularities:
-            generate = rnd.randrange(0, 3)
-            for x in range(0, generate):
+            if (self.thickness is LineThickness.THICK) and (self.line_irregularities is False):
+                self.add_width_points()
                 self.add_width_points()
-        self.thicken_line()
+
+            if self.line_irregularities:
+                generate = self.rnd.randrange(0, 3)
+                for x in range(0, generate):
+                    self.add_width_points()
+        with span("rasterize"):
+            self.thicken_line()
 
         if self.irregular_edge:
-            self.irregular_edges()
+            with span("edges"):
+                self.irregular_edges()
         if self.distortion:
-            self.distort_edges()
-            if self.main_print:
-                filtered = self.background.copy()
-                filtered = cv.medianBlur(filtered, 5)
-                ret, thresh = cv.threshold(filtered, 100, 255, cv.THRESH_BINARY)
-                self.background = thresh
-                if (self.distortion and self.artifacts) or (self.distortion and self.black_outline):
-                    self.distortion_mask()
+            with span("distortion"):
+                self.distort_edges()
+                if self.main_print:
+                    filtered = self.background.copy()
+                    filtered = cv.medianBlur(filtered, 5)
+                    ret, thresh = cv.threshold(filtered, 100, 255, cv.THRESH_BINARY)
+                    self.background = thresh
+                    if (self.distortion and self.artifacts) or (self.distortion and self.black_outline):
+                        self.distortion_mask()
 
         if self.black_outline:
-            self.draw_black_outline()
-        self.draw_on_background()
+            with span("edges"):
+                self.draw_black_outline()
+        with span("composite"):
+            self.draw_on_background()
         if self.artifacts:
-            self.generate_artifacts(patch_center=self.frequency_center)
-        self.crop_by_mask()
+            with span("rasterize"):
+                self.generate_artifacts(patch_center=self.frequency_center)
         if self.distortion is False:
-            ret, thresh = cv.threshold(self.background, 200, 255, cv.THRESH_BINARY)
-            self.background = thresh
+            self.composite_damage(threshold=200)
+        else:
+            self.composite_damage()
 
     def distortion_mask(self):
         """
@@ -260,6 +261,7 @@ class ScarGenerator(LineGenerator):
         for c in range(0, len(contours)):
             cv.drawContours(fingerprint_mask, contours, c, 255, -1)
         self.fingerprint.fingerprint_mask = fingerprint_mask
+        self.fingerprint.fingerprint_pixels = None
 
     def new_mask(self):
         """
@@ -286,6 +288,7 @@ class ScarGenerator(LineGenerator):
         else:
             radius = self.max_width*4
         scale = 1.1
+        soak_circles = 0
         point_without_distortion = None
         for i in range(0, len(self.control_points)-1):
             point_1 = self.control_points[i]
@@ -297,16 +300,18 @@ class ScarGenerator(LineGenerator):
                     cv.circle(self.background, point_1, radius, 255, 2)
                     cv.circle(distortion_mask, point_1, radius, 255, -1)
                     soak_of_circle_area(img_dist, point_1[1], point_1[0], radius, scale)
+                    soak_circles += 1
                 else:
                     if point_without_distortion is not None:
                         if self.distance(point_without_distortion, point_1) > radius//3:
                             cv.circle(distortion_mask, point_1, radius, 255, -1)
                             soak_of_circle_area(img_dist, point_1[1], point_1[0], radius, scale)
+                            soak_circles += 1
                             point_without_distortion = None
                     else:
                         point_without_distortion = point_1
 
-                    # generate = rnd.randrange(0, 6)
+                    # generate = self.rnd.randrange(0, 6)
                     # if generate < 1:
                     #     cv.circle(self.background, point_1, radius, 255, 2)
                     #     cv.circle(distortion_mask, point_1, radius, 255, -1)
@@ -321,12 +326,13 @@ class ScarGenerator(LineGenerator):
                         cv.circle(self.background, point_1, radius, 255, 2)
                         cv.circle(distortion_mask, point, radius, 255, -1)
                         soak_of_circle_area(img_dist, point[1], point[0], radius, scale)
+                        soak_circles += 1
 
         #cv.imshow("B", self.background)
+        Metrics.count("soak_circles", soak_circles)
         self.filter_mask = distortion_mask
 
         self.background = np.copy(img_dist.arrImage)
-        cv.waitKey()
 
     def more_than_one_point_outside(self):
         """
@@ -334,10 +340,7 @@ class ScarGenerator(LineGenerator):
         @brief: this function detects if there are more than one control point generated outside fingerprint area
         :return: True if yes, false if no
         """
-        outside_points = 0
-        for point in self.control_points:
-            if self.background_mask[point[1], point[0]] == 0:
-                outside_points += 1
+        outside_points = np.count_nonzero(self.points_outside(self.control_points))
         if outside_points > 1:
             return True
         return False
@@ -350,17 +353,16 @@ class ScarGenerator(LineGenerator):
         :return: None
         """
         pixels = self.get_damage_pixels()
-        frequency = rnd.randrange(10, 1000)
+        frequency = self.rnd.randrange(10, 1000)
         frequency = 100
-        for p in pixels:
-            black_point = rnd.randrange(0, frequency)
-            if black_point < 1:
-                self.background[p[0], p[1]] = 0
-            black_oval = rnd.randrange(0, frequency)
-            if black_oval < 1:
-                self.black_patch(p)
+        artifacts = np.zeros(self.damage_canvas.shape, bool)
+        black_points = pixels[self.np_random.randint(0, frequency, size=len(pixels)) < 1]
+        artifacts[black_points[:, 0], black_points[:, 1]] = True
+        for p in pixels[self.np_random.randint(0, frequency, size=len(pixels)) < 1]:
+            self.black_patch(p)
         if patch_center:
-            self.intensify_black_patches_in_area(frequency)
+            self.intensify_black_patches_in_area(frequency, artifacts)
+        self.add_damage_layer(artifacts, 0)
 
     def black_patch(self, point):
         """
@@ -369,33 +371,35 @@ class ScarGenerator(LineGenerator):
         :param point: coordinates of point in (x,y) format
         :return: None
         """
-        amount = rnd.randrange(3, 10)
+        amount = self.rnd.randrange(3, 10)
+        Metrics.count("patch_circles", amount)
         x_coord = point[0]
         y_coord = point[1]
         for patch in range(0, amount):
-            variance_x = rnd.randrange(-1, 2)
-            variance_y = rnd.randrange(-1, 2)
+            variance_x = self.rnd.randrange(-1, 2)
+            variance_y = self.rnd.randrange(-1, 2)
             x_coord = x_coord + variance_x
             y_coord = y_coord + variance_y
             cv.circle(self.damage_canvas, (y_coord, x_coord), 1, 0, -1)
 
-    def intensify_black_patches_in_area(self, frequency):
+    def intensify_black_patches_in_area(self, frequency, artifacts):
         """
 
         @brief: Randomly chooses area of scar and generates greater amount of black artifacts in this area.
         :param frequency: int number measuring amount of black artefacts in scar - higher frequency means higher number.
+        :param artifacts: boolean array of black artifacts, pixels of scar erased by black patches are added to it
         :return: None
         """
 
-        frequency_multiplier = rnd.randrange(5, 11)
+        frequency_multiplier = self.rnd.randrange(5, 11)
         frequency = frequency//frequency_multiplier
-        index = rnd.randrange(0, len(self.damage_pixels)-1)
+        index = self.rnd.randrange(0, len(self.damage_pixels)-1)
         center = self.damage_pixels[index]
         radius = self.length//4
         radius_variance = radius//2
         if radius_variance < 1:
             radius_variance = 1
-        radius += rnd.randrange(0, radius_variance)
+        radius += self.rnd.randrange(0, radius_variance)
 
         x_start = center[1]-radius//2
         if x_start < 0:
@@ -413,7 +417,7 @@ class ScarGenerator(LineGenerator):
         if y_end >= self.fingerprint.img_height:
             y_end = self.fingerprint.img_height - 1
 
-        rand_arr = np.random.randint(frequency, size=(y_end - y_start, x_end - x_start))
+        rand_arr = self.np_random.randint(frequency, size=(y_end - y_start, x_end - x_start))
         indexes = np.where(rand_arr == 0)
         indexes_y = indexes[0] + y_start
         indexes_x = indexes[1] + x_start
@@ -421,9 +425,8 @@ class ScarGenerator(LineGenerator):
         for index in range(len(indexes_y)):
             self.black_patch((indexes_y[index], indexes_x[index]))
 
-        for point in self.damage_pixels:
-            if self.damage_canvas[point[0], point[1]] == 0:
-                self.background[point[0], point[1]] = 0
+        erased = self.damage_canvas[self.damage_pixels[:, 0], self.damage_pixels[:, 1]] == 0
+        artifacts[self.damage_pixels[erased, 0], self.damage_pixels[erased, 1]] = True
 
     def irregular_edges(self):
         """
@@ -433,52 +436,50 @@ class ScarGenerator(LineGenerator):
         :return: None
         """
         edge_points = self.get_edge_coordinates()
+        circles = 0
         for p in edge_points:
             if self.length_type != LineLength.SHORT:
-                generate = rnd.randrange(0, 10)
+                generate = self.rnd.randrange(0, 10)
                 if generate < 2:
                     radius = self.max_width // 3
                     if self.thickness == LineThickness.THICK:
                         radius = self.max_width // 4
                     cv.circle(self.damage_canvas, (p[1], p[0]), radius, 0, -1)
+                    circles += 1
             else:
-                generate = rnd.randrange(0, 30)
+                generate = self.rnd.randrange(0, 30)
                 if generate < 1:
                     cv.circle(self.damage_canvas, (p[1], p[0]), self.max_width // 5, 0, -1)
-            generate = rnd.randrange(0, 40)
+                    circles += 1
+            generate = self.rnd.randrange(0, 40)
             if generate < 1:
                 cv.circle(self.damage_canvas, (p[1], p[0]), 2, 0, -1)
+                circles += 1
+        Metrics.count("edge_circles", circles)
 
     def draw_black_outline(self):
         """
 
         @brief: On every pixel of detected edge of scar generates a variable amount of black points. Every black point
-                is then shifted in x and y axis by random amount and drawn.
+                is then shifted in x and y axis by random amount and drawn. Random walks of all edge pixels are
+                computed at once and all points are drawn in one pass.
         :return: None
         """
         self.new_edges = self.get_edge_coordinates()
+        if len(self.new_edges) == 0:
+            return
 
-        canvas = np.ones(self.fingerprint.img.shape[:2], np.uint8)
-        white_canvas = canvas * 255
-
-        for point in self.new_edges:
-            generate = rnd.randrange(0, 10)
-
-            if generate < 8:
-                cv.circle(self.background, (point[1], point[0]), 1, 0, -1)
-                cv.circle(white_canvas, (point[1], point[0]), 1, 0, -1)
-                amount = rnd.randrange(3, 10)
-                x_coord = point[0]
-                y_coord = point[1]
-                for patch in range(0, amount):
-                    variance = self.max_width//6
-                    variance_x = rnd.randrange(-variance, variance+1)
-                    variance_y = rnd.randrange(-variance, variance+1)
-                    x_coord = x_coord + variance_x
-                    y_coord = y_coord + variance_y
-                    cv.circle(self.background, (y_coord, x_coord), 1, 0, -1)
-                    cv.circle(white_canvas, (y_coord, x_coord), 1, 0, -1)
-
-
+        # edges are in (y,x) format, walks are computed in (x,y) format
+        seeds = self.new_edges.reshape(-1, 2)[:, ::-1]
+        seeds = seeds[self.np_random.randint(0, 10, size=len(seeds)) < 8]
 
+        max_steps = 9
+        variance = self.max_width // 6
+        amounts = self.np_random.randint(3, max_steps + 1, size=len(seeds))
+        steps = self.np_random.randint(-variance, variance + 1, size=(len(seeds), max_steps, 2))
+        walks = seeds[:, np.newaxis, :] + np.cumsum(steps, axis=1)
+        walk_points = walks[np.arange(max_steps)[np.newaxis, :] < amounts[:, np.newaxis]]
 
+        outline = self.create_damage_canvas()
+        self.draw_disks(outline, np.concatenate((seeds, walk_points)), 1, 255)
+        self.add_damage_layer(outline > 0, 0)
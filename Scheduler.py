@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Created By  : Vanessa Jóriová
+# Date        : 8.5.2022
+# Version     : 1.0
+
+from CostModel import CostModel
+
+# amount of work units per worker, more units balance workers better, fewer units keep variants of one template in
+# one worker
+UNITS_PER_WORKER = 8
+
+
+class Scheduler:
+    """
+    Cost-aware scheduler of tasks for pool of workers. Tasks are split into work units - consecutive tasks with the same
+    template (variants of one image) are kept together, so template is loaded by one worker, but groups more expensive
+    than fair share of work are split. Units are ordered from the most expensive one (largest processing time first),
+    so expensive tasks (e.g. scars with distortion) run early and cheap tasks (e.g. hair) fill the tail. Workers take
+    next unit from shared queue as soon as they finish previous one, so no worker waits while other workers have
+    queued work
+    """
+
+    def __init__(self, workers, cost_model=None):
+        """
+
+        :param workers: amount of workers
+        :param cost_model: CostModel instance estimating time of tasks, None uses default costs
+        """
+        self.workers = workers
+        self.cost_model = cost_model or CostModel()
+
+    @staticmethod
+    def group_tasks(tasks):
+        """
+
+        @brief: Groups consecutive tasks with the same template
+        :param tasks: list of tasks
+        :return: list of groups of tasks
+        """
+        groups = []
+        for task in tasks:
+            if groups and groups[-1][-1]["image"] == task["image"]:
+                groups[-1].append(task)
+            else:
+                groups.append([task])
+        return groups
+
+    def create_units(self, tasks):
+        """
+
+        @brief: Splits tasks into work units ordered from the most expensive one
+        :param tasks: list of tasks
+        :return: list of units, every unit is list of tasks
+        """
+        costs = {id(task): self.cost_model.estimate_task(task)[1] for task in tasks}
+        grain = sum(costs.values()) / (self.workers * UNITS_PER_WORKER)
+
+        units = []
+        for group in self.group_tasks(tasks):
+            unit, unit_cost = [], 0.0
+            for task in group:
+                if unit and unit_cost + costs[id(task)] > grain:
+                    units.append((unit_cost, unit))
+                    unit, unit_cost = [], 0.0
+                unit.append(task)
+                unit_cost += costs[id(task)]
+            units.append((unit_cost, unit))
+        units.sort(key=lambda unit: unit[0], reverse=True)
+        return [unit for _, unit in units]
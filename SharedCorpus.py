@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Created By  : Vanessa Jóriová
+# Date        : 8.5.2022
+# Version     : 1.0
+
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from FingerprintImage import FingerprintImage
+
+# arrays of template stored in shared memory
+SHARED_ARRAYS = ["img", "fingerprint_mask", "fingerprint_pixels"]
+
+# attributes of template sent to workers together with shared arrays
+TEMPLATE_ATTRIBUTES = ["path", "fingerprint_width", "fingerprint_height", "fingerprint_x", "fingerprint_y"]
+
+# shared memory blocks attached by this process, kept open while the process lives, so views of templates stay valid
+attached_blocks = {}
+
+
+class SharedCorpus:
+    """
+    Templates of fingerprints stored in shared memory. Main process loads every template and computes its mask once
+    and copies image, mask and fingerprint pixels into shared memory blocks. Worker processes attach read-only views
+    of these blocks instead of loading their own copies of templates, so memory does not grow with amount of workers.
+    Every shared template is described by picklable dictionary, which is sent to workers
+    """
+
+    def __init__(self):
+        # workers must use resource tracker of main process, otherwise tracker of worker would remove shared blocks
+        # when worker ends, so tracker has to run before worker processes are started
+        resource_tracker.ensure_running()
+        self.blocks = []
+        self.descriptions = {}
+
+    def share(self, template):
+        """
+
+        @brief: Copies template into shared memory, every template is copied only once
+        :param template: FingerprintImage instance with computed mask, size and fingerprint pixels
+        :return: description of shared template as dictionary
+        """
+        if template.path not in self.descriptions:
+            description = {attribute: getattr(template, attribute) for attribute in TEMPLATE_ATTRIBUTES}
+            for name in SHARED_ARRAYS:
+                array = getattr(template, name)
+                block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+                self.blocks.append(block)
+                description[name] = (block.name, array.shape, array.dtype.str)
+            self.descriptions[template.path] = description
+        return self.descriptions[template.path]
+
+    @staticmethod
+    def attach(description):
+        """
+
+        @brief: Creates template from shared memory in worker process, arrays of template are read-only views of shared
+                blocks, so template has to be copied (FingerprintImage.copy) before it is damaged
+        :param description: description of shared template
+        :return: FingerprintImage instance
+        """
+        template = FingerprintImage()
+        for attribute in TEMPLATE_ATTRIBUTES:
+            setattr(template, attribute, description[attribute])
+        for name in SHARED_ARRAYS:
+            block_name, shape, dtype = description[name]
+            if block_name not in attached_blocks:
+                attached_blocks[block_name] = shared_memory.SharedMemory(name=block_name)
+            array = np.ndarray(shape, np.dtype(dtype), buffer=attached_blocks[block_name].buf)
+            array.flags.writeable = False
+            setattr(template, name, array)
+        template.set_img(template.img)
+        return template
+
+    def close(self):
+        """
+
+        @brief: Releases all shared blocks, must be called after worker processes are stopped
+        :return: None
+        """
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+        self.descriptions = {}
@@ -6,10 +6,15 @@
 # Version     : 1.0
 
 from LineGenerator import LineGenerator, LineOrientation, LineLength, LineThickness
-import random as random
+from Generator import GenerationBudgetExceeded
+from Profiler import span
+import Metrics
 import cv2 as cv
 import numpy as np
 
+# size of cell of occupancy grid in pixels
+OCCUPANCY_CELL_SIZE = 8
+
 
 class WrinkleGenerator:
     """
@@ -17,59 +22,153 @@ class WrinkleGenerator:
     Class generating wrinkle damage into synthetic fingerprint image
     """
 
-    def __init__(self, fingerprint):
+    def __init__(self, fingerprint, rng=None):
         """
 
         :param fingerprint: instance of FingerprintImage
+        :param rng: random generators of task (see create_random_generators), None uses global random generators
         """
         self.fingerprint = fingerprint
-        self.line_generator = LineGenerator(fingerprint)
+        self.line_generator = LineGenerator(fingerprint, rng)
+        self.rnd = self.line_generator.rnd
         self.generated_image = None
         self.damage_pixels = np.zeros(self.line_generator.background.shape[:2], np.uint8)
+        self.attempt_counters = self.line_generator.attempt_counters
+
+        # coarse grid of cells touched by creases, used to reject overlapping creases before they are drawn
+        height, width = self.damage_pixels.shape
+        self.occupancy = np.zeros((-(-height // OCCUPANCY_CELL_SIZE), -(-width // OCCUPANCY_CELL_SIZE)), np.uint8)
+        self.line_generator.reject_control_points = self.is_polyline_overlapping_with_other
+
+    def set_budget(self, max_attempts=None, time_budget=None):
+        """
+
+        @brief: Sets attempt and time budget of every sampling stage of line generator
+        :param max_attempts: maximum number of attempts of sampling stage
+        :param time_budget: maximum time of sampling stage in seconds
+        :return: None
+        """
+        self.line_generator.set_budget(max_attempts, time_budget)
 
     def get_damage_pixels(self):
-        for point in self.line_generator.damage_pixels:
-            self.damage_pixels[point[0], point[1]] = 255
+        """
+
+        @brief: Adds pixels of last crease to damage pixels of all creases and marks every cell of occupancy grid
+                touched by last crease, other cells are not changed
+        :return: None
+        """
+        crease = self.line_generator.damage_canvas > 0
+        self.damage_pixels[crease] = 255
+        rows, columns = np.nonzero(crease)
+        self.occupancy[rows // OCCUPANCY_CELL_SIZE, columns // OCCUPANCY_CELL_SIZE] = 1
+
+    def is_polyline_overlapping_with_other(self, control_points):
+        """
+
+        @brief: Coarse overlap check done before crease is drawn - control polyline is rasterized into occupancy grid
+                and crease is rejected if more than half of its cells are already touched by other creases
+        :param control_points: control points of crease as (x,y) coordinates
+        :return: True if crease obviously overlaps with other creases, False if not
+        """
+        cells = np.zeros(self.occupancy.shape, np.uint8)
+        polyline = (control_points // OCCUPANCY_CELL_SIZE).astype(np.int32).reshape(-1, 1, 2)
+        cv.polylines(cells, [polyline], False, 1, 1)
+        overlapping_cells = np.count_nonzero(cells & self.occupancy)
+        if overlapping_cells > np.count_nonzero(cells) // 2:
+            return True
+        return False
 
     def is_crease_overlapping_with_other(self):
-        total_pixel_amount = len(self.line_generator.damage_pixels)
-        overlapping_pixels = 0
-        for pixel in self.line_generator.damage_pixels:
-            if self.damage_pixels[pixel[0], pixel[1]] == 255:
-                overlapping_pixels += 1
+        """
+
+        @brief: Checks if more than quarter of pixels of last crease overlaps with other creases
+        :return: True if crease overlaps, False if not
+        """
+        crease = self.line_generator.damage_canvas > 0
+        total_pixel_amount = np.count_nonzero(crease)
+        overlapping_pixels = np.count_nonzero(self.damage_pixels[crease])
         if overlapping_pixels > total_pixel_amount // 4:
             return True
         else:
             return False
 
     def generate_crease(self, line_length, line_orientation, line_thickness):
+        """
+
+        @brief: Proposes crease on private damage canvas of line generator until crease not overlapping with other
+                creases is found. Accepted crease is added to damage pixels, rejected proposals never touch background
+        :param line_length: LineLength enum value
+        :param line_orientation: LineOrientation enum value
+        :param line_thickness: LineThickness enum value
+        :return: None
+        """
         max_attempts = 100
         for i in range(0, max_attempts):
-            image_save = self.line_generator.background.copy()
-            self.line_generator.generate_line(length_type=line_length, orientation=line_orientation,
-                                              thickness=line_thickness)
-            if self.is_crease_overlapping_with_other() is False:
-                break
-            self.line_generator.background = image_save
+            self.line_generator.count_attempt("crease")
+            try:
+                drawn = self.line_generator.propose_line(length_type=line_length, orientation=line_orientation,
+                                                         thickness=line_thickness)
+            except GenerationBudgetExceeded as exc:
+                # crease that can not be generated within budget is skipped
+                print(f"Skipping crease: {exc}")
+                Metrics.count("crease_skips")
+                return
+            if not drawn:
+                # crease rejected by occupancy grid is proposed again with the same parameters
+                Metrics.count("crease_occupancy_rejections")
+                continue
+            with span("sample_geometry"):
+                if self.is_crease_overlapping_with_other() is False:
+                    self.get_damage_pixels()
+                    return
+            Metrics.count("crease_rejections")
+
+    def add_crease(self, line_length, line_orientation, line_thickness):
+        """
+
+        @brief: Proposes crease once without any overlap check and adds it to damage pixels, crease is drawn in the same
+                way as line drawn directly by line generator
+        :param line_length: LineLength enum value
+        :param line_orientation: LineOrientation enum value
+        :param line_thickness: LineThickness enum value
+        :return: None
+        """
+        reject_control_points = self.line_generator.reject_control_points
+        self.line_generator.reject_control_points = None
+        try:
+            self.line_generator.propose_line(length_type=line_length, orientation=line_orientation,
+                                             thickness=line_thickness)
+        finally:
+            self.line_generator.reject_control_points = reject_control_points
         self.get_damage_pixels()
 
+    def commit_creases(self):
+        """
+
+        @brief: Draws all accepted creases into fingerprint at once and stores generated image
+        :return: None
+        """
+        self.line_generator.damage_canvas = self.damage_pixels
+        self.line_generator.commit_line()
+        self.generated_image = self.line_generator.background.copy()
+
     def wrinkles_level_1(self):
         """
 
         @brief:  Generates creases of level 1 (damage consisting of 4-6 individual lines).
         :return: None
         """
-        max_amount = random.randrange(4, 7)
+        max_amount = self.rnd.randrange(4, 7)
 
         # amount of primary wrinkles (thin or medium, long or medium)
-        amount = random.randrange(2, 4)
-        generate = random.randrange(0, 10)
+        amount = self.rnd.randrange(2, 4)
+        generate = self.rnd.randrange(0, 10)
 
         thickness = LineThickness.THIN
 
         for x in range(0, amount):
 
-            generate = random.randrange(0, 20)
+            generate = self.rnd.randrange(0, 20)
             if generate < 16:
                 orientation = LineOrientation.HORIZONTAL
             elif generate < 18:
@@ -77,7 +176,7 @@ class WrinkleGenerator:
             else:
                 orientation = LineOrientation.DIAGONAL
 
-            line_length = random.choice((LineLength.LONG, LineLength.MEDIUM))
+            line_length = self.rnd.choice((LineLength.LONG, LineLength.MEDIUM))
             self.generate_crease(line_length, orientation, thickness)
 
         # short thin wrinkles added to get final amount of wrinkles in image
@@ -85,14 +184,14 @@ class WrinkleGenerator:
         if small_wrinkles_amount < 0:
             small_wrinkles_amount = 0
         for x in range(0, small_wrinkles_amount):
-            generate = random.randrange(0, 20)
+            generate = self.rnd.randrange(0, 20)
             if generate < 15:
                 orientation = LineOrientation.HORIZONTAL
             else:
                 orientation = LineOrientation.VERTICAL
             self.generate_crease(LineLength.SHORT, orientation, LineThickness.THIN)
 
-        self.generated_image = self.line_generator.background.copy()
+        self.commit_creases()
 
     def wrinkles_level_2(self):
         """
@@ -101,20 +200,20 @@ class WrinkleGenerator:
         :return: None
         """
 
-        max_amount = random.randrange(6, 13)
+        max_amount = self.rnd.randrange(6, 13)
 
         # amount of primary wrinkles (thin or medium and long or medium)
-        amount = random.randrange(2, 7)
+        amount = self.rnd.randrange(2, 7)
         thickness = LineThickness.THIN
         for x in range(0, amount):
-            generate = random.randrange(0, 20)
+            generate = self.rnd.randrange(0, 20)
             if generate < 16:
                 orientation = LineOrientation.HORIZONTAL
             elif generate < 18:
                 orientation = LineOrientation.VERTICAL
             else:
                 orientation = LineOrientation.DIAGONAL
-            line_length = random.choice((LineLength.LONG, LineLength.MEDIUM))
+            line_length = self.rnd.choice((LineLength.LONG, LineLength.MEDIUM))
             self.generate_crease(line_length, orientation, thickness)
 
         # short thin wrinkles added to get final amount of wrinkles in image
@@ -122,15 +221,15 @@ class WrinkleGenerator:
         if small_wrinkles_amount < 0:
             small_wrinkles_amount = 0
         for x in range(0, small_wrinkles_amount):
-            generate = random.randrange(0, 20)
+            generate = self.rnd.randrange(0, 20)
             if generate < 16:
                 orientation = LineOrientation.HORIZONTAL
             else:
                 orientation = LineOrientation.VERTICAL
-            self.line_generator.generate_line(length_type=LineLength.SHORT, orientation=orientation,
-                                              thickness=LineThickness.THIN)
+            # short creases of level 2 are not checked for overlap with other creases
+            self.add_crease(LineLength.SHORT, orientation, LineThickness.THIN)
 
-        self.generated_image = self.line_generator.background.copy()
+        self.commit_creases()
 
     def wrinkles_level_3(self):
         """
@@ -139,31 +238,31 @@ class WrinkleGenerator:
         :return: None
         """
 
-        total_amount = random.randrange(12, 21)
+        total_amount = self.rnd.randrange(12, 21)
 
         # amount of thick wrinkles
-        generate_thick = random.randrange(0, 2)
+        generate_thick = self.rnd.randrange(0, 2)
         if generate_thick:
             self.generate_crease(LineLength.LONG, LineOrientation.RANDOM, LineThickness.THICK)
 
         # amount of medium wrinkles
-        medium_amount = random.randrange(1, 3)
+        medium_amount = self.rnd.randrange(1, 3)
         for x in range(0, medium_amount):
-            generate = random.randrange(0, 20)
+            generate = self.rnd.randrange(0, 20)
             if generate < 16:
                 orientation = LineOrientation.HORIZONTAL
             elif generate < 18:
                 orientation = LineOrientation.VERTICAL
             else:
                 orientation = LineOrientation.DIAGONAL
-            line_len = random.choice((LineLength.LONG, LineLength.MEDIUM))
+            line_len = self.rnd.choice((LineLength.LONG, LineLength.MEDIUM))
             self.generate_crease(line_len, orientation, LineThickness.MEDIUM)
 
         # amount of long thin wrinkles
-        long_amount = random.randrange(0, 9)
+        long_amount = self.rnd.randrange(0, 9)
         for x in range(0, long_amount):
 
-            generate = random.randrange(0, 20)
+            generate = self.rnd.randrange(0, 20)
             if generate < 15:
                 orientation = LineOrientation.HORIZONTAL
             elif generate < 18:
@@ -176,9 +275,9 @@ class WrinkleGenerator:
         # thin short wrinkles are added to reach total amount of wrinkles
         thin_amount = total_amount - medium_amount - long_amount
         for x in range(0, thin_amount):
-            line_len = random.choice((LineLength.SHORT, LineLength.MEDIUM))
+            line_len = self.rnd.choice((LineLength.SHORT, LineLength.MEDIUM))
 
-            generate = random.randrange(0, 11)
+            generate = self.rnd.randrange(0, 11)
             if generate < 6:
                 orientation = LineOrientation.HORIZONTAL
             elif generate < 9:
@@ -187,7 +286,7 @@ class WrinkleGenerator:
                 orientation = LineOrientation.DIAGONAL
 
             self.generate_crease(line_len, orientation, LineThickness.THIN)
-        self.generated_image = self.line_generator.background.copy()
+        self.commit_creases()
 
     def show_generated_image(self):
         """